@@ -1,16 +1,47 @@
+# pylint: disable=C0302
 import argparse
-import importlib.metadata
+import functools
+import hashlib
+import json
 import logging
 import os
+import re
 import sys
-import yaml
+import tarfile
+import tempfile
 
-import requirements
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# NOTE: PyYAML, requirements-parser and packaging are only imported once they are
+# needed, so that the ansible-builder CLI, which builds its parser with this module,
+# starts quickly.
 
 
 base_collections_path = '/usr/share/ansible/collections'
+default_cache_max_entries = 512
+collection_archive_suffixes = ('.tar.gz', '.tgz')
 logger = logging.getLogger(__name__)
 
+# A single requirement line, and where it was read from
+RequirementEntry = namedtuple('RequirementEntry', ('line', 'file', 'lineno'))
+
+
+@functools.lru_cache(maxsize=None)
+def yaml_support():
+    """
+    Import PyYAML, and return it along with the safe loader and dumper classes
+    to use, which are the libyaml based ones when available.
+
+    This script runs standalone in the builder image, so it cannot share the
+    YAML helpers in ansible_builder.utils.
+    """
+    import yaml  # pylint: disable=C0415
+    try:
+        return yaml, yaml.CSafeLoader, yaml.CSafeDumper
+    except AttributeError:  # PyYAML was built without libyaml
+        return yaml, yaml.SafeLoader, yaml.SafeDumper
+
 
 def line_is_empty(line):
     return bool((not line.strip()) or line.startswith('#'))
@@ -24,103 +55,509 @@ def read_req_file(path):
         return f.read()
 
 
-def pip_file_data(path):
-    pip_content = read_req_file(path)
+# Matches the pip requirements file options that include another file
+pip_include_re = re.compile(r'^(?P<option>-r|--requirement|-c|--constraint)(?:\s*=\s*|\s+)(?P<filename>\S.*?)\s*$')
+
+
+def req_file_key(path):
+    """Return a (identity, version) tuple for a requirements file on disk, its
+    real path and modification time. The version is None if the file is missing.
+    """
+    realpath = os.path.realpath(path)
+    try:
+        return (realpath, os.stat(realpath).st_mtime_ns)
+    except OSError:
+        return (realpath, None)
+
 
-    pip_lines = []
-    for line in pip_content.split('\n'):
+def parse_pip_content(content):
+    """Return a list of (lineno, kind, value) tuples for the meaningful lines of a
+    pip requirements file. The kind is 'line' for a requirement, and 'requirement'
+    or 'constraint' for an include of another file, whose name is the value.
+    """
+    parsed = []
+    for lineno, line in enumerate(content.split('\n'), start=1):
         if line_is_empty(line):
             continue
-        if line.startswith('-r') or line.startswith('--requirement'):
-            _, new_filename = line.split(None, 1)
-            new_path = os.path.join(os.path.dirname(path or '.'), new_filename)
-            pip_lines.extend(pip_file_data(new_path))
+        if match := pip_include_re.match(line):
+            kind = 'constraint' if match.group('option') in ('-c', '--constraint') else 'requirement'
+            parsed.append((lineno, kind, match.group('filename')))
         else:
-            pip_lines.append(line)
+            parsed.append((lineno, 'line', line))
+    return parsed
+
+
+class RequirementsFileCache:
+    """Parsed pip requirements files, keyed by their identity and version as
+    returned by req_file_key(), so that files included by many collections are
+    read and parsed once per introspection run.
+    """
+
+    def __init__(self):
+        self._files = {}
+
+    def parse(self, path, read, key):
+        if key[1] is None:
+            return parse_pip_content(read(path))
+        parsed = self._files.get(key)
+        if parsed is None:
+            parsed = self._files[key] = parse_pip_content(read(path))
+        return parsed
+
+
+def resolve_pip_file(path, read=read_req_file, key=req_file_key, file_cache=None):
+    """Return a tuple of (requirement_entries, constraint_entries) for a pip
+    requirements file, where the entries are RequirementEntry tuples.
+
+    Files included with ``-r`` and ``-c`` are followed recursively. Everything
+    included from a constraints file is a constraint.
+
+    :param str path: Path of the requirements file, as given to ``read`` and ``key``.
+    :param read: Callable returning the contents of a file.
+    :param key: Callable returning the (identity, version) of a file, see req_file_key().
+    :param RequirementsFileCache file_cache: Optional cache of parsed files.
+    """
+    file_cache = file_cache or RequirementsFileCache()
+    requirement_entries = []
+    constraint_entries = []
+
+    def _resolve(path, is_constraint, including):
+        file_key = key(path)
+        if file_key[0] in including:
+            chain = ' -> '.join(list(including.values()) + [path])
+            raise RuntimeError(f'Requirements files include each other in a cycle: {chain}')
+        including[file_key[0]] = path
+
+        for lineno, kind, value in file_cache.parse(path, read, file_key):
+            if kind == 'line':
+                entries = constraint_entries if is_constraint else requirement_entries
+                entries.append(RequirementEntry(value, path, lineno))
+            else:
+                new_path = os.path.join(os.path.dirname(path or '.'), value)
+                _resolve(new_path, is_constraint or kind == 'constraint', including)
+
+        del including[file_key[0]]
+
+    _resolve(path, False, {})
+    return (requirement_entries, constraint_entries)
 
-    return pip_lines
 
+def pip_file_data(path, read=read_req_file):
+    return [entry.line for entry in resolve_pip_file(path, read=read)[0]]
 
-def bindep_file_data(path):
-    sys_content = read_req_file(path)
 
-    sys_lines = []
-    for line in sys_content.split('\n'):
+def bindep_file_entries(path, read=read_req_file):
+    """Return the requirements in a bindep file as a list of RequirementEntry tuples"""
+    sys_content = read(path)
+
+    sys_entries = []
+    for lineno, line in enumerate(sys_content.split('\n'), start=1):
         if line_is_empty(line):
             continue
-        sys_lines.append(line)
+        sys_entries.append(RequirementEntry(line, path, lineno))
+
+    return sys_entries
+
+
+def bindep_file_data(path, read=read_req_file):
+    return [entry.line for entry in bindep_file_entries(path, read=read)]
+
+
+class IntrospectionCache:
+    """A persistent, content-addressed store of collection introspection results.
+
+    Entries are keyed by the FILES.json checksum recorded in the collection
+    MANIFEST.json file. FILES.json in turn records the checksum of every file in
+    the collection, so an unchanged key means unchanged collection content.
+    Collections without that checksum (e.g., source checkouts) are not cached,
+    nor are collections that include requirements files from outside of them.
+
+    Each entry is a small JSON file in the cache directory. The file modification
+    time is refreshed on every hit, and the least recently used entries are
+    evicted by ``prune()`` once there are more than ``max_entries`` of them.
+    """
+
+    # Bump this whenever the format of the cached values changes.
+    format_version = 3
+
+    def __init__(self, cache_dir, max_entries=default_cache_max_entries):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        os.makedirs(self.cache_dir, exist_ok=True)
 
-    return sys_lines
+    def key(self, collection_path):
+        """Return the cache key for a collection, or None if it cannot be cached"""
+        try:
+            with open(os.path.join(collection_path, 'MANIFEST.json'), 'r') as f:
+                return self.key_from_manifest(f.read())
+        except OSError:
+            return None
 
+    def key_from_manifest(self, manifest_text):
+        """Return the cache key for the given MANIFEST.json contents, or None if it cannot be cached"""
+        try:
+            manifest = json.loads(manifest_text)
+            files_checksum = manifest['file_manifest_file']['chksum_sha256']
+        except (ValueError, KeyError, TypeError):
+            return None
+        if not files_checksum:
+            return None
+        identity = [self.format_version, files_checksum, manifest.get('collection_info')]
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key):
+        """Return the cached tuple, or None on a miss"""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r') as f:
+                data = json.load(f)
+            os.utime(entry_path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return tuple(data)
 
-def process_collection(path):
+    def put(self, key, value):
+        """Atomically store a tuple of JSON serializable values"""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(list(value), f)
+            os.replace(tmp_path, self._entry_path(key))
+        except OSError as e:
+            logger.warning('Unable to write introspection cache entry %s: %s', key, e)
+
+    def prune(self):
+        """Evict the least recently used entries beyond the size limit"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.json'):
+                    try:
+                        entries.append((entry.stat().st_mtime_ns, entry.path))
+                    except FileNotFoundError:
+                        continue  # evicted concurrently
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(reverse=True)
+        for dummy, entry_path in entries[self.max_entries:]:
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                pass
+
+
+def process_collection(path, cache=None):
     """Return a tuple of (python_dependencies, system_dependencies) for the
     collection install path given.
     Both items returned are a list of dependencies.
 
     :param str path: root directory of collection (this would contain galaxy.yml file)
+    :param IntrospectionCache cache: Optional cache of previously introspected collections.
+    """
+    dummy, pip_entries, bindep_entries, dummy = introspect_collection(path, cache=cache)
+    return ([entry.line for entry in pip_entries], [entry.line for entry in bindep_entries])
+
+
+def process_collection_archive(path, cache=None):
+    """Return a tuple of (collection_name, python_dependencies, system_dependencies)
+    for the collection artifact given, without extracting it, or None if the
+    collection name cannot be determined.
+
+    :param str path: path to a collection artifact, as built by ``ansible-galaxy collection build``
+    :param IntrospectionCache cache: Optional cache of previously introspected collections.
+    """
+    result = introspect_collection_archive(path, cache=cache)
+    if result is None:
+        return None
+    collection_name, pip_entries, bindep_entries, dummy = result
+    return (collection_name, [entry.line for entry in pip_entries], [entry.line for entry in bindep_entries])
+
+
+def introspect_collection(path, cache=None, file_cache=None, collection_name=None):
+    """Return a tuple of (collection_name, pip_entries, bindep_entries, constraint_entries)
+    for the collection install path given, where the entries are RequirementEntry tuples.
+    The collection name is taken from the path, unless given.
+    """
+    collection_name = collection_name or '.'.join(path_namespace_name(path))
+
+    key = cache.key(path) if cache else None
+    if key:
+        cached = _entries_from_cache(cache.get(key))
+        if cached is not None:
+            logger.debug('Using cached introspection data for %s', path)
+            return (collection_name, *cached)
+
+    read_paths = []
+    result = read_collection_requirements(CollectionDefinition(path), file_cache=file_cache, read_paths=read_paths)
+    # The cache key only covers the collection contents
+    if key and not _outside_collection(read_paths):
+        cache.put(key, result)
+
+    return (collection_name, *result)
+
+
+def introspect_collection_archive(path, cache=None, file_cache=None):
+    """Return a tuple of (collection_name, pip_entries, bindep_entries, constraint_entries)
+    for the collection artifact given, where the entries are RequirementEntry tuples,
+    or None if the collection name cannot be determined.
+    """
+    archive = CollectionArchive(path)
+    try:
+        manifest = archive.read_manifest()
+        if manifest is None and not archive.has_file('galaxy.yml'):
+            logger.warning('Ignoring %s, which has no MANIFEST.json or galaxy.yml file', path)
+            return None
+        namespace_name = archive.namespace_name()
+    except (tarfile.TarError, OSError) as e:
+        logger.warning('Ignoring %s, which cannot be read as a collection artifact: %s', path, e)
+        return None
+    if namespace_name is None:
+        logger.warning('Ignoring %s, which has no manifest and is not named like a collection artifact', path)
+        return None
+    collection_name = '.'.join(namespace_name)
+
+    key = cache.key_from_manifest(manifest) if cache and manifest else None
+    if key:
+        cached = _entries_from_cache(cache.get(key))
+        if cached is not None:
+            logger.debug('Using cached introspection data for %s', path)
+            return (collection_name, *cached)
+
+    try:
+        # Reads the whole archive, see CollectionArchive
+        definition = ArchiveCollectionDefinition(archive)
+    except (tarfile.TarError, OSError) as e:
+        logger.warning('Ignoring %s, which cannot be read as a collection artifact: %s', path, e)
+        return None
+    read_paths = []
+    result = read_collection_requirements(definition, file_cache=file_cache, read_paths=read_paths)
+    # The cache key only covers the collection contents
+    if key and not _outside_collection(read_paths):
+        cache.put(key, result)
+
+    return (collection_name, *result)
+
+
+def _entries_from_cache(cached):
+    if cached is None:
+        return None
+    return tuple([RequirementEntry(*entry) for entry in entries] for entries in cached)
+
+
+def read_collection_requirements(CD, file_cache=None, read_paths=None):
+    """Return a tuple of (pip_entries, bindep_entries, constraint_entries) declared
+    by the given collection definition. File names in the entries are relative to
+    the collection root.
+
+    :param list read_paths: Optional list, extended with the path of every
+        requirements file read, including the files that are included.
     """
-    CD = CollectionDefinition(path)
+    read_paths = [] if read_paths is None else read_paths
+
+    def file_key(path):
+        read_paths.append(path)
+        return CD.file_key(path)
 
     py_file = CD.get_dependency('python')
-    pip_lines = []
+    pip_entries = []
+    constraint_entries = []
     if py_file:
-        pip_lines = pip_file_data(os.path.join(path, py_file))
+        pip_entries, constraint_entries = resolve_pip_file(
+            CD.dependency_path(py_file), read=CD.read_file, key=file_key, file_cache=file_cache
+        )
 
     sys_file = CD.get_dependency('system')
-    bindep_lines = []
+    bindep_entries = []
     if sys_file:
-        bindep_lines = bindep_file_data(os.path.join(path, sys_file))
+        read_paths.append(CD.dependency_path(sys_file))
+        bindep_entries = bindep_file_entries(CD.dependency_path(sys_file), read=CD.read_file)
 
-    return (pip_lines, bindep_lines)
+    return (pip_entries, bindep_entries, constraint_entries)
 
 
-def process(data_dir=base_collections_path, user_pip=None, user_bindep=None):
-    paths = []
-    path_root = os.path.join(data_dir, 'ansible_collections')
+def _outside_collection(paths):
+    """Return True if any of the given paths, relative to a collection root, is outside of it"""
+    return any(os.path.isabs(path) or os.path.normpath(path).split(os.sep)[0] == os.pardir for path in paths)
 
-    # build a list of all the valid collection paths
-    if os.path.exists(path_root):
-        for namespace in sorted(os.listdir(path_root)):
-            if not os.path.isdir(os.path.join(path_root, namespace)):
-                continue
-            for name in sorted(os.listdir(os.path.join(path_root, namespace))):
-                collection_dir = os.path.join(path_root, namespace, name)
-                if not os.path.isdir(collection_dir):
-                    continue
-                files_list = os.listdir(collection_dir)
-                if 'galaxy.yml' in files_list or 'MANIFEST.json' in files_list:
-                    paths.append(collection_dir)
 
-    # populate the requirements content
+def is_collection_archive(path):
+    return bool(path) and os.fspath(path).endswith(collection_archive_suffixes) and os.path.isfile(path)
+
+
+def find_collection_archives(data_dir):
+    """Return the sorted collection artifacts at the given path, which may be
+    a single artifact or a directory containing artifacts.
+    """
+    if is_collection_archive(data_dir):
+        return [data_dir]
+    if not data_dir or not os.path.isdir(data_dir):
+        return []
+    return sorted(
+        entry.path for entry in os.scandir(data_dir)
+        if entry.name.endswith(collection_archive_suffixes) and entry.is_file()
+    )
+
+
+class CollectionRecord:
+    """A collection found by discover_collections(), either installed in a
+    directory or as a collection artifact. The namespace and name of an
+    artifact are only known once it has been read.
+    """
+
+    __slots__ = ('path', 'namespace', 'name', 'is_archive')
+
+    def __init__(self, path, namespace=None, name=None, is_archive=False):
+        self.path = path
+        self.namespace = namespace
+        self.name = name
+        self.is_archive = is_archive
+
+    def introspect(self, cache=None, file_cache=None):
+        """Return a tuple of (collection_name, pip_entries, bindep_entries, constraint_entries)"""
+        if self.is_archive:
+            return introspect_collection_archive(self.path, cache=cache, file_cache=file_cache)
+        return introspect_collection(
+            self.path, cache=cache, file_cache=file_cache, collection_name=f'{self.namespace}.{self.name}'
+        )
+
+
+def _sorted_subdirs(path):
+    with os.scandir(path) as it:
+        return sorted((entry for entry in it if entry.is_dir()), key=lambda entry: entry.name)
+
+
+def discover_collections(data_dir):
+    """Return a list of CollectionRecord for every collection under the given path.
+
+    Collections installed in an ``ansible_collections`` directory come first,
+    sorted by namespace and name, followed by any collection artifacts
+    (``.tar.gz`` files), sorted by file name.
+    """
+    collections = []
+    path_root = os.path.join(data_dir, 'ansible_collections') if data_dir else None
+
+    if path_root and os.path.isdir(path_root):
+        for namespace in _sorted_subdirs(path_root):
+            for name in _sorted_subdirs(namespace.path):
+                with os.scandir(name.path) as it:
+                    if any(entry.name in ('galaxy.yml', 'MANIFEST.json') for entry in it):
+                        collections.append(CollectionRecord(name.path, namespace.name, name.name))
+
+    collections.extend(CollectionRecord(path, is_archive=True) for path in find_collection_archives(data_dir))
+    return collections
+
+
+def iter_collections(data_dir=base_collections_path, jobs=1, cache=None, file_cache=None):
+    """Yield a (collection_name, pip_entries, bindep_entries, constraint_entries) tuple
+    for every collection found under the given path, where the entries are
+    RequirementEntry tuples. Collections without requirements are included.
+
+    Collections are yielded in the order of discover_collections(). Each result is
+    yielded as soon as it, and every result before it, has been read.
+
+    See process() for the meaning of the arguments.
+    """
+    collections = discover_collections(data_dir)
+
+    file_cache = file_cache or RequirementsFileCache()
+    introspect = functools.partial(CollectionRecord.introspect, cache=cache, file_cache=file_cache)
+
+    # Read the collection requirements, possibly concurrently. map() yields
+    # results in the order of the sorted paths, so the output is deterministic.
+    if jobs > 1 and len(collections) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            yield from _unique_collections(collections, executor.map(introspect, collections))
+    else:
+        yield from _unique_collections(collections, map(introspect, collections))
+
+    if cache:
+        cache.prune()
+
+
+def _unique_collections(collections, results):
+    seen = set()
+    for collection, result in zip(collections, results):
+        if result is None:
+            continue
+        collection_name = result[0]
+        if collection_name in seen:
+            logger.warning('Collection %s was already found, ignoring %s', collection_name, collection.path)
+            continue
+        seen.add(collection_name)
+        yield result
+
+
+def process(data_dir=base_collections_path, user_pip=None, user_bindep=None, jobs=1, cache=None, on_collection=None):
+    """Return the Python and system requirements for every collection found
+    under the given path, keyed by fully qualified collection name.
+
+    Collections installed in an ``ansible_collections`` directory come first,
+    followed by any collection artifacts (``.tar.gz`` files), sorted by file name.
+
+    :param str data_dir: Path containing an ``ansible_collections`` directory and/or
+        collection artifacts, or the path to a single collection artifact. If None,
+        only the user requirements files are processed.
+    :param str user_pip: Optional user pip requirements file to combine.
+    :param str user_bindep: Optional user bindep requirements file to combine.
+    :param int jobs: Number of collections to read concurrently. The result
+        ordering is the same regardless of this value.
+    :param IntrospectionCache cache: Optional cache of previously introspected collections.
+    :param on_collection: Optional callable, called with the (collection_name, pip_entries,
+        bindep_entries, constraint_entries) of each collection as soon as it is read, and
+        last with the entries of the user requirements files under the name ``user``.
+
+    The result also has a ``constraints`` key, in the same format, if any pip
+    constraints files were included with ``-c``.
+    """
+    # Shared by all collections, so common included files are parsed once
+    file_cache = RequirementsFileCache()
     py_req = {}
     sys_req = {}
-    for path in paths:
-        col_pip_lines, col_sys_lines = process_collection(path)
-        CD = CollectionDefinition(path)
-        namespace, name = CD.namespace_name()
-        key = f'{namespace}.{name}'
+    constraints = {}
+    for collection in iter_collections(data_dir, jobs=jobs, cache=cache, file_cache=file_cache):
+        if on_collection:
+            on_collection(*collection)
+
+        key, col_pip_entries, col_sys_entries, col_constraint_entries = collection
+        if col_pip_entries:
+            py_req[key] = [entry.line for entry in col_pip_entries]
 
-        if col_pip_lines:
-            py_req[key] = col_pip_lines
+        if col_sys_entries:
+            sys_req[key] = [entry.line for entry in col_sys_entries]
 
-        if col_sys_lines:
-            sys_req[key] = col_sys_lines
+        if col_constraint_entries:
+            constraints[key] = [entry.line for entry in col_constraint_entries]
 
     # add on entries from user files, if they are given
+    user_pip_entries, user_constraint_entries = [], []
     if user_pip:
-        col_pip_lines = pip_file_data(user_pip)
-        if col_pip_lines:
-            py_req['user'] = col_pip_lines
-    if user_bindep:
-        col_sys_lines = bindep_file_data(user_bindep)
-        if col_sys_lines:
-            sys_req['user'] = col_sys_lines
-
-    return {
+        user_pip_entries, user_constraint_entries = resolve_pip_file(user_pip, file_cache=file_cache)
+    user_sys_entries = bindep_file_entries(user_bindep) if user_bindep else []
+    if on_collection and (user_pip or user_bindep):
+        on_collection('user', user_pip_entries, user_sys_entries, user_constraint_entries)
+    if user_pip_entries:
+        py_req['user'] = [entry.line for entry in user_pip_entries]
+    if user_sys_entries:
+        sys_req['user'] = [entry.line for entry in user_sys_entries]
+    if user_constraint_entries:
+        constraints['user'] = [entry.line for entry in user_constraint_entries]
+
+    data = {
         'python': py_req,
         'system': sys_req
     }
+    if constraints:
+        data['constraints'] = constraints
+    return data
+
+
+def path_namespace_name(collection_path):
+    "Returns 2-tuple of namespace and name of the collection installed at the given path"
+    path_parts = [p for p in collection_path.split(os.path.sep) if p]
+    return tuple(path_parts[-2:])
 
 
 def has_content(candidate_file):
@@ -144,13 +581,12 @@ class CollectionDefinition:
         self.reference_path = collection_path
 
         # NOTE: Filenames should match constants.DEAFULT_EE_BASENAME and constants.YAML_FILENAME_EXTENSIONS.
-        meta_file_base = os.path.join(collection_path, 'meta', 'execution-environment')
         ee_exists = False
         for ext in ('yml', 'yaml'):
-            meta_file = f"{meta_file_base}.{ext}"
-            if os.path.exists(meta_file):
-                with open(meta_file, 'r') as f:
-                    self.raw = yaml.safe_load(f)
+            meta_content = self._read_optional(os.path.join('meta', f'execution-environment.{ext}'))
+            if meta_content is not None:
+                yaml, loader, _ = yaml_support()
+                self.raw = yaml.load(meta_content, Loader=loader)
                 ee_exists = True
                 break
 
@@ -158,10 +594,32 @@ class CollectionDefinition:
             self.raw = {'version': 1, 'dependencies': {}}
             # Automatically infer requirements for collection
             for entry, filename in [('python', 'requirements.txt'), ('system', 'bindep.txt')]:
-                candidate_file = os.path.join(collection_path, filename)
-                if has_content(candidate_file):
+                if self._has_content(filename):
                     self.raw['dependencies'][entry] = filename
 
+    def _read_optional(self, relative_path):
+        """Return the contents of a file in the collection, or None if it does not exist"""
+        try:
+            with open(os.path.join(self.reference_path, relative_path), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _has_content(self, relative_path):
+        content = self._read_optional(relative_path)
+        return bool(content and content.strip())
+
+    def dependency_path(self, relative_path):
+        """Return the path to give read_file() for a file relative to the collection root"""
+        return os.path.normpath(relative_path)
+
+    def read_file(self, path):
+        return read_req_file(os.path.join(self.reference_path, path))
+
+    def file_key(self, path):
+        """Return the (identity, version) of a file given to read_file(), see req_file_key()"""
+        return req_file_key(os.path.join(self.reference_path, path))
+
     def target_dir(self):
         namespace, name = self.namespace_name()
         return os.path.join(
@@ -171,8 +629,7 @@ class CollectionDefinition:
 
     def namespace_name(self):
         "Returns 2-tuple of namespace and name"
-        path_parts = [p for p in self.reference_path.split(os.path.sep) if p]
-        return tuple(path_parts[-2:])
+        return path_namespace_name(self.reference_path)
 
     def get_dependency(self, entry):
         """A collection is only allowed to reference a file by a relative path
@@ -190,12 +647,126 @@ class CollectionDefinition:
         return req_file
 
 
+class CollectionArchive:
+    """Read access to the dependency files of a collection artifact, the
+    ``.tar.gz`` file built by ``ansible-galaxy collection build``, without
+    extracting it.
+
+    The archive is decompressed as a stream, once. Only MANIFEST.json, the
+    collection execution environment metadata and small requirements-like text
+    files are kept in memory; all other file contents are skipped. Files are
+    only decoded when they are read.
+    """
+
+    max_prefetch_size = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._files = None  # prefetched file contents, as bytes, by name
+        self._members = None  # member names of all regular files in the archive, by name
+
+    @staticmethod
+    def _member_name(member):
+        return os.path.normpath(member.name)
+
+    def _should_prefetch(self, name, size):
+        if name == 'MANIFEST.json' or name.startswith('meta/execution-environment.'):
+            return True
+        return name.endswith(('.txt', '.in')) and size <= self.max_prefetch_size
+
+    def _scan(self):
+        files = {}
+        members = {}
+        with tarfile.open(self.path, 'r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                name = self._member_name(member)
+                members[name] = member.name
+                if self._should_prefetch(name, member.size):
+                    files[name] = tar.extractfile(member).read()
+        self._files = files
+        self._members = members
+
+    def read_manifest(self):
+        """Return the contents of MANIFEST.json, or None if the archive has none.
+
+        Before the archive has been scanned, only the archive members up to the
+        manifest are read, which is normally just the first one.
+        """
+        if self._files is not None:
+            manifest = self._files.get('MANIFEST.json')
+            return None if manifest is None else manifest.decode()
+        with tarfile.open(self.path, 'r|*') as tar:
+            for member in tar:
+                if member.isfile() and self._member_name(member) == 'MANIFEST.json':
+                    return tar.extractfile(member).read().decode()
+        return None
+
+    def has_file(self, name):
+        """Return True if the archive has a regular file with the given name"""
+        if self._members is None:
+            self._scan()
+        return os.path.normpath(name) in self._members
+
+    def read(self, name):
+        """Return the contents of a file in the archive, or None if it does not exist"""
+        if self._files is None:
+            self._scan()
+        name = os.path.normpath(name)
+        if name in self._files:
+            return self._files[name].decode()
+        if name not in self._members:
+            return None
+        # Unusually named or large files are not prefetched, read them with random access.
+        with tarfile.open(self.path, 'r:*') as tar:
+            return tar.extractfile(tar.getmember(self._members[name])).read().decode()
+
+    def namespace_name(self):
+        """Returns 2-tuple of namespace and name, from the manifest or else the
+        file name, or None if neither has them
+        """
+        try:
+            info = json.loads(self.read_manifest() or '{}')['collection_info']
+            return (info['namespace'], info['name'])
+        except (ValueError, KeyError, TypeError):
+            parts = os.path.basename(self.path).split('-')
+            if len(parts) < 2:
+                return None
+            return (parts[0], parts[1])
+
+
+class ArchiveCollectionDefinition(CollectionDefinition):
+    """The dependency metadata for a collection artifact, read without extracting it"""
+
+    def __init__(self, archive):
+        self.archive = archive
+        super().__init__(archive.path)
+
+    def _read_optional(self, relative_path):
+        return self.archive.read(relative_path)
+
+    def read_file(self, path):
+        content = self.archive.read(path)
+        if content is None:
+            raise FileNotFoundError(f'Expected requirements file not present in {self.archive.path}: {path}')
+        return content
+
+    def file_key(self, path):
+        identity, version = req_file_key(self.archive.path)
+        return ((identity, os.path.normpath(path)), version)
+
+    def namespace_name(self):
+        return self.archive.namespace_name()
+
+
 def simple_combine(reqs):
     """Given a dictionary of requirement lines keyed off collections,
     return a list with the most basic of de-duplication logic,
     and comments indicating the sources based off the collection keys
     """
-    consolidated = []
+    # maps each de-duplicated line to its index in fancy_lines
+    consolidated = {}
     fancy_lines = []
     for collection, lines in reqs.items():
         for line in lines:
@@ -203,12 +774,12 @@ def simple_combine(reqs):
                 continue
 
             base_line = line.split('#')[0].strip()
-            if base_line in consolidated:
-                i = consolidated.index(base_line)
+            i = consolidated.get(base_line)
+            if i is not None:
                 fancy_lines[i] += f', {collection}'
             else:
                 fancy_line = f'{base_line}  # from collection {collection}'
-                consolidated.append(base_line)
+                consolidated[base_line] = len(fancy_lines)
                 fancy_lines.append(fancy_line)
 
     return fancy_lines
@@ -235,29 +806,81 @@ def parse_args(args=None):
 
 
 def run_introspect(args, log):
-    data = process(args.folder, user_pip=args.user_pip, user_bindep=args.user_bindep)
+    cache = None
+    if args.cache_dir:
+        cache = IntrospectionCache(args.cache_dir, max_entries=args.cache_max_entries)
+    on_collection = print_collection_record if args.output_format == 'ndjson' else None
+    data = process(args.folder, user_pip=args.user_pip, user_bindep=args.user_bindep, jobs=args.jobs, cache=cache,
+                   on_collection=on_collection)
     if args.sanitize:
         log.info('# Sanitized dependencies for %s', args.folder)
         data_for_write = data
-        data['python'] = sanitize_requirements(data['python'])
+        try:
+            data['python'] = sanitize_requirements(data['python'])
+        except RequirementsConflictError as e:
+            log.error(str(e))
+            sys.exit(1)
         data['system'] = simple_combine(data['system'])
+        if 'constraints' in data:
+            data['constraints'] = simple_combine(data['constraints'])
     else:
         log.info('# Dependency data for %s', args.folder)
         data_for_write = data.copy()
         data_for_write['python'] = simple_combine(data['python'])
         data_for_write['system'] = simple_combine(data['system'])
-
-    print('---')
-    print(yaml.dump(data, default_flow_style=False))
+        if 'constraints' in data:
+            data_for_write['constraints'] = simple_combine(data['constraints'])
+
+    if args.output_format == 'ndjson':
+        # The collection records have already been printed as they were read
+        if args.sanitize:
+            print(json.dumps({'type': 'sanitized', **data}), flush=True)
+    elif args.output_format == 'json':
+        print(json.dumps(data, indent=2))
+    else:
+        yaml, _, dumper = yaml_support()
+        print('---')
+        print(yaml.dump(data, Dumper=dumper, default_flow_style=False))
 
     if args.write_pip and data.get('python'):
         write_file(args.write_pip, data_for_write.get('python') + [''])
     if args.write_bindep and data.get('system'):
         write_file(args.write_bindep, data_for_write.get('system') + [''])
+    if args.write_constraints and data.get('constraints'):
+        write_file(args.write_constraints, data_for_write.get('constraints') + [''])
 
     sys.exit(0)
 
 
+def print_collection_record(collection_name, pip_entries, bindep_entries, constraint_entries):
+    """Print the requirements of a single collection as one line of JSON,
+    recording the file and line number each requirement was read from.
+    """
+    def entry_data(entry):
+        return {'requirement': entry.line, 'file': entry.file, 'line': entry.lineno}
+
+    record = {
+        'type': 'collection',
+        'collection': collection_name,
+        'python': [entry_data(entry) for entry in pip_entries],
+        'system': [entry_data(entry) for entry in bindep_entries],
+    }
+    if constraint_entries:
+        record['constraints'] = [entry_data(entry) for entry in constraint_entries]
+    print(json.dumps(record), flush=True)
+
+
+def positive_int(value):
+    """argparse type for options that require an integer of at least 1"""
+    try:
+        number = int(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f'invalid int value: {value!r}') from e
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {number}')
+    return number
+
+
 def create_introspect_parser(parser):
     introspect_parser = parser.add_parser(
         'introspect',
@@ -277,7 +900,9 @@ def create_introspect_parser(parser):
         'folder', default=base_collections_path, nargs='?',
         help=(
             'Ansible collections path(s) to introspect. '
-            'This should have a folder named ansible_collections inside of it.'
+            'This should have a folder named ansible_collections inside of it, and/or collection '
+            'artifacts (.tar.gz files) which are read without being extracted. '
+            'This may also be the path to a single collection artifact.'
         )
     )
     # Combine user requirements and collection requirements into single file
@@ -299,6 +924,31 @@ def create_introspect_parser(parser):
         '--write-bindep', dest='write_bindep',
         help='Write the combined bindep requirements file to this location.'
     )
+    introspect_parser.add_argument(
+        '--write-constraints', dest='write_constraints',
+        help='Write the combined pip constraints file to this location, if any constraints files were included.'
+    )
+    introspect_parser.add_argument(
+        '-j', '--jobs', dest='jobs',
+        type=positive_int, default=1,
+        help='Number of collections to read concurrently (default: %(default)s).'
+    )
+    introspect_parser.add_argument(
+        '--cache-dir', dest='cache_dir',
+        help=('Directory used to persist introspection results between runs, keyed by the '
+              'collection MANIFEST.json contents. Caching is disabled if unset.')
+    )
+    introspect_parser.add_argument(
+        '--cache-max-entries', dest='cache_max_entries',
+        type=positive_int, default=default_cache_max_entries,
+        help='Maximum number of collections kept in the introspection cache (default: %(default)s).'
+    )
+    introspect_parser.add_argument(
+        '--output-format', dest='output_format',
+        choices=('yaml', 'json', 'ndjson'), default='yaml',
+        help=('Format of the output (default: %(default)s). With ndjson, one JSON record is printed per '
+              'collection as soon as it is read, recording the file and line of every requirement.')
+    )
 
     return introspect_parser
 
@@ -316,6 +966,115 @@ EXCLUDE_REQUIREMENTS = frozenset((
 ))
 
 
+class RequirementsConflictError(RuntimeError):
+    """Raised when the combined requirements for a package can never be satisfied"""
+
+
+def _is_excluded(req):
+    """Whether a consolidated requirement is dropped by sanitize_requirements(),
+    which excludes packages unless they are present in the user requirements.
+
+    Names are compared in their PEP 503 normalized form, because the names of
+    requirements with a version specifier are normalized with underscores.
+    """
+    if not req.name or 'user' in req.collections:
+        return False
+    return re.sub(r'[-_.]+', '-', req.name).lower() in EXCLUDE_REQUIREMENTS
+
+
+def _release_prefix_bounds(release):
+    """Return the inclusive lower and exclusive upper version bounds of a
+    release prefix match, e.g. ``1.4.*`` is ``>=1.4.dev0`` and ``<1.5.dev0``
+    """
+    from packaging.version import Version  # pylint: disable=C0415
+
+    upper = list(release)
+    upper[-1] += 1
+    return (
+        Version('.'.join(str(p) for p in release) + '.dev0'),
+        Version('.'.join(str(p) for p in upper) + '.dev0'),
+    )
+
+
+def _specifier_bounds(op, version):
+    """Translate a single version specifier into interval bounds.
+
+    :returns: A list of ``(kind, version, inclusive)`` tuples, where kind is one
+        of ``lower``, ``upper`` or ``exclude``. Specifiers that cannot be reasoned
+        about as an interval return an empty list and are never reported as
+        conflicting.
+    """
+    from packaging.version import InvalidVersion, Version  # pylint: disable=C0415
+
+    if op == '===':
+        return []
+    wildcard = version.endswith('.*')
+    try:
+        parsed = Version(version[:-2] if wildcard else version)
+    except InvalidVersion:
+        return []
+
+    if wildcard:
+        if op != '==':
+            return []  # "!=1.*" excludes a range, which never empties an interval on its own
+        lower, upper = _release_prefix_bounds(parsed.release)
+        return [('lower', lower, True), ('upper', upper, False)]
+    if op == '==':
+        return [('lower', parsed, True), ('upper', parsed, True)]
+    if op == '!=':
+        return [('exclude', parsed, True)]
+    if op == '>=':
+        return [('lower', parsed, True)]
+    if op == '>':
+        return [('lower', parsed, False)]
+    if op == '<=':
+        return [('upper', parsed, True)]
+    if op == '<':
+        return [('upper', parsed, False)]
+    if op == '~=' and len(parsed.release) > 1:
+        dummy, upper = _release_prefix_bounds(parsed.release[:-1])
+        return [('lower', parsed, True), ('upper', upper, False)]
+    return []
+
+
+def find_specifier_conflict(spec_sources):
+    """Intersect the version specifiers requested for a single package.
+
+    The specifiers are treated as intervals over the version ordering, which
+    never reports a satisfiable combination as conflicting, although pip may
+    still reject some combinations not caught here (e.g. pre-release rules).
+
+    :param list spec_sources: A list of ``((op, version), collection)`` tuples.
+
+    :returns: None if the specifiers can be satisfied together, otherwise a
+        2-tuple of the ``((op, version), collection)`` entries that conflict.
+    """
+    # pylint: disable=E1136
+    lower = upper = None
+    excludes = []
+    for spec, collection in spec_sources:
+        for kind, version, inclusive in _specifier_bounds(*spec):
+            bound = (version, inclusive, (spec, collection))
+            if kind == 'exclude':
+                excludes.append(bound)
+            elif kind == 'lower':
+                if lower is None or version > lower[0] or (version == lower[0] and not inclusive):
+                    lower = bound
+            elif upper is None or version < upper[0] or (version == upper[0] and not inclusive):
+                upper = bound
+
+    if lower is None or upper is None:
+        return None
+    if lower[0] > upper[0] or (lower[0] == upper[0] and not (lower[1] and upper[1])):
+        return (lower[2], upper[2])
+    if lower[0] == upper[0]:
+        # the interval is a single version, which must not be excluded
+        for version, dummy, source in excludes:
+            if version == lower[0]:
+                return (lower[2], source)
+    return None
+
+
 def sanitize_requirements(collection_py_reqs):
     """
     Cleanup Python requirements by removing duplicates and excluded packages.
@@ -328,10 +1087,17 @@ def sanitize_requirements(collection_py_reqs):
         from the user specified requirements file from the ``--user-pip`` CLI option.
 
     :returns: A finalized list of sanitized Python requirements.
+
+    :raises: RequirementsConflictError if the version specifiers requested for
+        a package can never be satisfied together.
     """
+    import importlib.metadata  # pylint: disable=C0415
+    import requirements  # pylint: disable=C0415
+
     # de-duplication
     consolidated = []
-    seen_pkgs = set()
+    # maps a package name to its first requirement in consolidated
+    reqs_by_name = {}
 
     for collection, lines in collection_py_reqs.items():
         try:
@@ -339,26 +1105,43 @@ def sanitize_requirements(collection_py_reqs):
                 if req.specifier:
                     req.name = importlib.metadata.Prepared(req.name).normalized
                 req.collections = [collection]  # add backref for later
+                req.spec_sources = [(spec, collection) for spec in req.specs]
                 if req.name is None:
                     consolidated.append(req)
                     continue
-                if req.name in seen_pkgs:
-                    for prior_req in consolidated:
-                        if req.name == prior_req.name:
-                            prior_req.specs.extend(req.specs)
-                            prior_req.collections.append(collection)
-                            break
+                prior_req = reqs_by_name.get(req.name)
+                if prior_req is not None:
+                    prior_req.specs.extend(req.specs)
+                    prior_req.spec_sources.extend(req.spec_sources)
+                    prior_req.collections.append(collection)
                     continue
                 consolidated.append(req)
-                seen_pkgs.add(req.name)
+                reqs_by_name[req.name] = req
         except Exception as e:
             logger.warning('Warning: failed to parse requirements from %s, error: %s', collection, e)
 
+    # detection of version specifiers that can never be satisfied together,
+    # ignoring the packages that are removed below
+    conflicts = []
+    for req in reqs_by_name.values():
+        if _is_excluded(req):
+            continue
+        if len(req.spec_sources) > 1 and (conflict := find_specifier_conflict(req.spec_sources)):
+            (spec_a, collection_a), (spec_b, collection_b) = conflict
+            conflicts.append(
+                f"{req.name}: '{''.join(spec_a)}' from collection {collection_a} "
+                f"conflicts with '{''.join(spec_b)}' from collection {collection_b}"
+            )
+    if conflicts:
+        raise RequirementsConflictError(
+            'Unsatisfiable Python requirements found:\n  ' + '\n  '.join(conflicts)
+        )
+
     # removal of unwanted packages
     sanitized = []
     for req in consolidated:
         # Exclude packages, unless it was present in the user supplied requirements.
-        if req.name and req.name.lower() in EXCLUDE_REQUIREMENTS and 'user' not in req.collections:
+        if _is_excluded(req):
             logger.debug('# Excluding requirement %s from %s', req.name, req.collections)
             continue
         if req.vcs or req.uri:
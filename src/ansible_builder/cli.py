@@ -2,16 +2,16 @@ import argparse
 import logging
 import sys
 import os
-import importlib.metadata
 
 from . import constants
 
 from .colors import MessageColors
 from .exceptions import DefinitionError
-from .main import AnsibleBuilder
 from .policies import PolicyChoices
-from ._target_scripts.introspect import create_introspect_parser, run_introspect
-from .utils import configure_logger
+from ._target_scripts.introspect import create_introspect_parser, positive_int, run_introspect
+
+# NOTE: Modules that are only needed to run a command, such as .main for the create
+# and build commands, are imported by run(), so that --help and --version stay fast.
 
 
 logger = logging.getLogger(__name__)
@@ -40,11 +40,27 @@ class CustomVerbosityAction(argparse.Action):
         setattr(namespace, self.dest, self.count)
 
 
+class VersionAction(argparse.Action):
+    """
+    Print the ansible-builder version and exit, like the argparse 'version'
+    action, but only look the version up when the option is used.
+    """
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        # pylint: disable=W0622
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message=f'{get_version()}\n')
+
+
 def run():
     args = parse_args()
+
+    from .utils import configure_logger  # pylint: disable=C0415
     configure_logger(args.verbosity)
 
     if args.action in ['create', 'build']:
+        from .main import AnsibleBuilder  # pylint: disable=C0415
         ab = AnsibleBuilder(**vars(args))
         action = getattr(ab, ab.action)
         try:
@@ -66,6 +82,7 @@ def run():
 
 
 def get_version():
+    import importlib.metadata  # pylint: disable=C0415
     return importlib.metadata.version('ansible_builder')
 
 
@@ -107,8 +124,7 @@ def add_container_options(parser):
     build_command_parser.add_argument(
         '--container-runtime',
         choices=list(constants.runtime_files.keys()),
-        default=constants.default_container_runtime,
-        help='Specifies which container runtime to use (default: %(default)s)')
+        help='Specifies which container runtime to use (default: podman if it is installed, otherwise docker)')
 
     build_command_parser.add_argument(
         '--build-arg',
@@ -181,6 +197,39 @@ def add_container_options(parser):
                        help='The number of signatures that must successfully verify collections from '
                        'ansible-galaxy ~if there are any signatures provided~. See ansible-galaxy doc for more info.')
 
+        p.add_argument('--host-introspect',
+                       action='store_true',
+                       help='Install collections and introspect their requirements on the host, and write the '
+                       'combined requirements into the build context. The builder stage of the image build then '
+                       'no longer waits for the galaxy stage. Requires ansible-galaxy on the host.')
+
+        p.add_argument('--copy-jobs',
+                       type=positive_int,
+                       default=1,
+                       help='Number of files to compare and copy into the build context concurrently, which can '
+                       'speed up large additional_build_files trees (default: %(default)s)')
+
+        p.add_argument('--context-copy-mode',
+                       choices=constants.context_copy_modes,
+                       default=constants.default_context_copy_mode,
+                       help='How files are copied into the build context (choices: %(choices)s). '
+                       '"reflink" clones files without copying their data on filesystems that support it, such as '
+                       'Btrfs and XFS, "hardlink" links to the original files, and "auto" uses a reflink when '
+                       'possible. Files are copied normally when the chosen method is not possible. '
+                       'Defaults to "%(default)s".')
+
+        p.add_argument('--prune-context',
+                       action='store_true',
+                       help='Remove files from the build context that were not produced by this run, such as '
+                       'files from a previous version of the execution environment definition.')
+
+        p.add_argument('--cache-mounts',
+                       action='store_true',
+                       help='Use build cache mounts (RUN --mount=type=cache) for the pip and package manager '
+                       'downloads, and the ansible-galaxy server response cache, so they are reused by later '
+                       'builds. Requires podman or docker with BuildKit. Same as the cache_mounts option of the '
+                       'execution environment definition.')
+
     introspect_parser = create_introspect_parser(parser)
 
     for n in [create_command_parser, build_command_parser, introspect_parser]:
@@ -206,7 +255,7 @@ def parse_args(args=None):
         )
     )
     parser.add_argument(
-        '--version', action='version', version=get_version(),
+        '--version', action=VersionAction,
         help='Print ansible-builder version and exit.'
     )
 
@@ -8,10 +8,20 @@ runtime_files = {
     'podman': 'Containerfile',
     'docker': 'Dockerfile'
 }
-default_container_runtime = 'podman'
+# NOTE: default_container_runtime is detected when it is first used, see __getattr__()
 base_roles_path = '/usr/share/ansible/roles'
 base_collections_path = '/usr/share/ansible/collections'
 
+# Targets of the build cache mounts used with the cache_mounts option
+pip_cache_mount = '/var/cache/ansible-builder/pip'
+galaxy_cache_mount = '/var/cache/ansible-builder/galaxy'
+introspect_cache_mount = '/var/cache/ansible-builder/introspect'
+pkgmgr_cache_mounts = ('/var/cache/dnf', '/var/cache/yum')
+
+# Builder stage paths used with the single_python_install option
+builder_tools_path = '/tmp/builder-tools'
+python_install_root = '/tmp/python-root'
+
 build_arg_defaults = {
     # empty string values here still allow the build arg to be emitted into the generated Containerfile
     'ANSIBLE_GALAXY_CLI_COLLECTION_OPTS': '',
@@ -23,12 +33,28 @@ build_arg_defaults = {
 }
 
 user_content_subfolder = '_build'
+# Subdirectory of user_content_subfolder for requirements introspected on the host
+host_introspect_subfolder = 'introspected'
+# Subdirectory of the user cache directory (e.g. ~/.cache) used by ansible-builder
+user_cache_subfolder = 'ansible-builder'
+# Combined pip constraints file from collections, honored by the assemble script
+upper_constraints_file = 'upper-constraints.txt'
+# Record of the files synced into the build context, kept outside of user_content_subfolder
+# so that it does not invalidate the image layers that copy that folder
+context_manifest_file = '.ab-manifest.json'
+# Fingerprint of the inputs of the last create, to skip creating an unchanged build context
+context_fingerprint_file = '.ab-fingerprint.json'
+# Bump this whenever the inputs of Containerfile.input_fingerprint() change
+fingerprint_version = 1
+# Image label holding the digest of the build context and options an image was built from
+image_input_digest_label = 'ansible-builder.input-digest'
+# Ways to copy files into the build context, see utils.copy_file()
+context_copy_modes = ('copy', 'reflink', 'hardlink', 'auto')
+default_context_copy_mode = 'copy'
 
-if shutil.which('podman'):
-    default_container_runtime = 'podman'
-else:
-    default_container_runtime = 'docker'
-
+# Cache of the capabilities of the container runtimes, see utils.get_runtime_capabilities()
+runtime_capabilities_file = 'runtime-capabilities.json'
+runtime_capabilities_ttl = 24 * 60 * 60
 default_keyring_name = 'keyring.gpg'
 default_policy_file_name = 'policy.json'
 
@@ -48,3 +74,12 @@ FINAL_IMAGE_BIN_PATH = "/opt/builder/bin"
 
 DEFAULT_EE_BASENAME = "execution-environment"
 YAML_FILENAME_EXTENSIONS = ('yml', 'yaml')
+
+
+def __getattr__(name):
+    # Detecting the container runtime looks for its executable, so it is only
+    # done when default_container_runtime is used. utils.detect_container_runtime()
+    # caches it.
+    if name == 'default_container_runtime':
+        return 'podman' if shutil.which('podman') else 'docker'
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,35 +1,61 @@
 from __future__ import annotations
 
+import hashlib
+import importlib.metadata
 import importlib.resources
+import json
 import logging
 import os
+import shlex
 
 from pathlib import Path
 
+import yaml
+
 from . import constants
-from .user_definition import UserDefinition
-from .utils import copy_directory, copy_file
+from ._target_scripts.introspect import (
+    IntrospectionCache, RequirementsConflictError, process, sanitize_requirements, simple_combine
+)
+from .exceptions import DefinitionError
+from .user_definition import ResolvedDefinition, UserDefinition
+from .utils import (
+    ContextManifest, copy_file, copy_files, directory_file_pairs, get_cache_dir, run_command, write_file,
+    yaml_safe_load
+)
 
 
 logger = logging.getLogger(__name__)
 
 
+def _is_remote_url(value: str) -> bool:
+    """Return True if a galaxy requirement source is a URL of remote content, unlike e.g. git+file:// URLs"""
+    scheme, separator, _ = value.partition('://')
+    return bool(separator) and scheme.rsplit('+', 1)[-1].lower() != 'file'
+
+
 class Containerfile:
     newline_char = '\n'
 
     def __init__(self,
-                 definition: UserDefinition,
+                 definition: UserDefinition | ResolvedDefinition,
                  build_context: str,
                  container_runtime: str,
                  output_filename: str | None = None,
                  galaxy_keyring: str | None = None,
                  galaxy_required_valid_signature_count: int | None = None,
-                 galaxy_ignore_signature_status_codes: list | None = None
+                 galaxy_ignore_signature_status_codes: list | None = None,
+                 host_introspect: bool = False,
+                 copy_jobs: int = 1,
+                 context_copy_mode: str = constants.default_context_copy_mode,
+                 prune_context: bool = False,
+                 cache_mounts: bool = False,
+                 build_args: dict[str, str | None] | None = None,
                  ) -> None:
         """
         Initialize a Containerfile object for instruction file creation.
 
-        :param UserDefinition definition: Object describing the EE definition.
+        :param definition: Object describing the EE definition. A UserDefinition
+            is used through its ResolvedDefinition.
         :param str build_context: Name of the build context subdirectory.
         :param str container_runtime: Name of the container runtime in use.
         :param str output_filename: Name of the resulting instruction file. If not supplied, it
@@ -39,12 +65,26 @@ class Containerfile:
         :param int galaxy_required_valid_signature_count: Number of sigs (prepend + to disallow no sig)
             required for ansible-galaxy to accept collections.
         :param list galaxy_ignore_signature_status_codes: GPG Status codes to ignore when validating galaxy collections.
+        :param bool host_introspect: If True, install the collections and introspect their
+            requirements on the host, so that the builder stage does not depend on the galaxy stage.
+        :param int copy_jobs: Number of files to compare and copy into the build context concurrently.
+        :param str context_copy_mode: How files are copied into the build context, one of
+            constants.context_copy_modes. See utils.copy_file().
+        :param bool prune_context: If True, remove any files from the build context subfolder that
+            were not produced by this run, such as files from a previous version of the definition.
+        :param bool cache_mounts: If True, use build cache mounts for the pip and package manager
+            download caches, and the galaxy server response cache. Also enabled by the cache_mounts
+            option of v3 definitions.
+        :param dict build_args: Build arguments given to the container runtime, which override
+            the build_arg_defaults of the definition. A None value is taken from the environment.
         """
 
         self.build_context = build_context
         self.build_outputs_dir = os.path.join(
             build_context, constants.user_content_subfolder)
-        self.definition = definition
+        if isinstance(definition, UserDefinition):
+            definition = definition.resolved
+        self.definition: ResolvedDefinition = definition
         if output_filename is None:
             output_filename = constants.runtime_files[container_runtime]
         self.path = os.path.join(self.build_context, output_filename)
@@ -53,6 +93,21 @@ class Containerfile:
         self.copied_galaxy_keyring = None
         self.galaxy_required_valid_signature_count = galaxy_required_valid_signature_count
         self.galaxy_ignore_signature_status_codes = galaxy_ignore_signature_status_codes
+        self.host_introspect = host_introspect
+        self.host_introspect_dir = os.path.join(self.build_outputs_dir, constants.host_introspect_subfolder)
+        self.copy_jobs = copy_jobs
+        self.context_copy_mode = context_copy_mode
+        self.prune_context = prune_context
+        self.build_args = build_args or {}
+        self.cache_mounts = cache_mounts or self.definition.cache_mounts
+        # The builder stage of v3 definitions is always based on the base image, so that
+        # Python packages installed there can be copied as is into the final image.
+        self.single_python_install = self.definition.single_python_install
+        self.mount_builder_output = self.definition.mount_builder_output
+        # Absolute paths of everything produced in the build outputs directory by prepare()
+        self.context_paths: set[str] = set()
+        self.galaxy_context_deferred = False
+        self.fingerprint_path = os.path.join(self.build_context, constants.context_fingerprint_file)
         self.steps: list = []
 
     def prepare(self) -> None:
@@ -81,19 +136,26 @@ class Containerfile:
 
         self._insert_global_args()
         self._create_folder_copy_files()
+        if self.host_introspect:
+            self._run_host_introspection()
+        if self.prune_context:
+            # Before any step is added based on the files in the build context
+            self._prune_build_outputs_dir()
         self._insert_custom_steps('prepend_base')
 
         if not self.definition.builder_image:
             if self.definition.python_package_system:
                 step = 'RUN $PKGMGR install $PYPKG -y ; if [ -z $PKGMGR_PRESERVE_CACHE ]; then $PKGMGR clean all; fi'
+                if self.cache_mounts:
+                    step = f'RUN {self._cache_mount_opts("pkgmgr")}$PKGMGR install $PYPKG -y'
                 self.steps.append(step)
 
             # pip needs to be available for later stages.
-            if self.definition.version >= 3 and not self.definition.options['skip_pip_install']:
+            if not self.definition.skip_pip_install:
                 self.steps.append('RUN /output/scripts/pip_install $PYCMD')
 
             if self.definition.ansible_ref_install_list:
-                self.steps.append('RUN $PYCMD -m pip install --no-cache-dir $ANSIBLE_INSTALL_REFS')
+                self.steps.append(f'RUN {self._pip_install_cmd()} $ANSIBLE_INSTALL_REFS')
 
         self._insert_custom_steps('append_base')
 
@@ -103,7 +165,7 @@ class Containerfile:
         # NOTE: This stage is skipped if there are no galaxy requirements.
         ######################################################################
 
-        if self.definition.get_dep_abs_path('galaxy'):
+        if self.definition.get_dependency('galaxy'):
             self.steps.extend([
                 "",
                 "# Galaxy build stage",
@@ -120,6 +182,7 @@ class Containerfile:
             self._prepare_ansible_config_file()
             self._prepare_build_context()
             self._prepare_galaxy_install_steps()
+            self._prepare_build_context_after_galaxy_install()
             self._insert_custom_steps('append_galaxy')
 
         ######################################################################
@@ -143,8 +206,12 @@ class Containerfile:
 
         self._insert_global_args()
 
-        if image == "base":
-            self.steps.append("RUN $PYCMD -m pip install --no-cache-dir bindep pyyaml requirements-parser")
+        if image == "base" and self.single_python_install:
+            # Keep the builder tools apart, so that they are not mistaken for installed requirements.
+            self.steps.append(f"RUN {self._pip_install_cmd()} --target {constants.builder_tools_path} "
+                              "bindep pyyaml requirements-parser")
+        elif image == "base":
+            self.steps.append(f"RUN {self._pip_install_cmd()} bindep pyyaml requirements-parser")
         else:
             # For an EE schema earlier than v3 with a custom builder image, we always make sure pip is available.
             context_dir = Path(self.build_outputs_dir).stem
@@ -152,7 +219,9 @@ class Containerfile:
             self.steps.append("RUN /output/scripts/pip_install $PYCMD")
 
         self._insert_custom_steps('prepend_builder')
-        self._prepare_galaxy_copy_steps()
+        if not self.host_introspect:
+            # Collections are only needed here to introspect their requirements.
+            self._prepare_galaxy_copy_steps()
         self._prepare_introspect_assemble_steps()
         self._insert_custom_steps('append_builder')
 
@@ -172,22 +241,22 @@ class Containerfile:
 
         # Run the check for 'ansible' and 'ansible-runner' installations for
         # any EE version 3 or above, unless explicitly skipped.
-        if self.definition.version >= 3 and not self.definition.options['skip_ansible_check']:
+        if not self.definition.skip_ansible_check:
             self.steps.append("RUN /output/scripts/check_ansible $PYCMD")
 
         self._prepare_galaxy_copy_steps()
         self._prepare_system_runtime_deps_steps()
 
-        if self.definition.version >= 3 and self.definition.options['relax_passwd_permissions']:
+        if self.definition.relax_passwd_permissions:
             self._relax_etc_passwd_permissions()
 
-        if self.definition.version >= 3 and (final_workdir := self.definition.options['workdir']):
+        if final_workdir := self.definition.workdir:
             self._prepare_final_workdir(final_workdir)
 
         # install init package if specified
         # FUTURE: could move this into the pre-install wheel phase
-        if init_pip_pkg := self.definition.container_init.get('package_pip'):
-            self.steps.append(f"RUN $PYCMD -m pip install --no-cache-dir '{init_pip_pkg}'")
+        if init_pip_pkg := self.definition.init_package_pip:
+            self.steps.append(f"RUN {self._pip_install_cmd()} '{init_pip_pkg}'")
 
         self._insert_custom_steps('append_final')
 
@@ -195,7 +264,7 @@ class Containerfile:
         self.steps.append("RUN rm -rf /output")
 
         self._prepare_label_steps()
-        if self.definition.version >= 3 and (uid := self.definition.options['user']):
+        if uid := self.definition.user:
             self._prepare_user_steps(uid)
         self._prepare_entrypoint_steps()
 
@@ -209,6 +278,101 @@ class Containerfile:
             for step in self.steps:
                 f.write(step + self.newline_char)
 
+    def input_fingerprint(self) -> str:
+        """
+        Return a digest of everything that the generated build context depends on:
+        the ansible-builder version and scripts, the EE definition file, the files
+        it references, and the options of this object. Files that are copied into
+        the build context are only stat()ed, not read.
+        """
+        inputs: list = [
+            constants.fingerprint_version,
+            importlib.metadata.version('ansible_builder'),
+            os.path.abspath(self.build_context),
+            self.path,
+            self.original_galaxy_keyring,
+            self.galaxy_required_valid_signature_count,
+            self.galaxy_ignore_signature_status_codes,
+            self.host_introspect,
+            self.context_copy_mode,
+            self.prune_context,
+            self.cache_mounts,
+            # Only used to install the collections on the host
+            self._build_arg('ANSIBLE_GALAXY_CLI_COLLECTION_OPTS') if self.host_introspect else None,
+        ]
+
+        with open(self.definition.filename, 'rb') as f:
+            inputs.append(hashlib.sha256(f.read()).hexdigest())
+
+        files = [self.original_galaxy_keyring, self.definition.ansible_config]
+        for item, value in constants.CONTEXT_FILES.items():
+            # inline dependencies are part of the definition file itself
+            if value and (dependency := self.definition.get_dependency(item)) and dependency.path is not None:
+                files.append(dependency.path)
+
+        scriptres = importlib.resources.files('ansible_builder._target_scripts')
+        files.extend(str(script) for script in scriptres.iterdir() if script.is_file())
+
+        ee_dir = Path(self.definition.filename).parent
+        for src_entry, dest in self.definition.additional_build_files:
+            src = Path(src_entry)
+            inputs.append(dest)
+            for src_file in sorted([src] if src.is_absolute() else ee_dir.glob(str(src))):
+                files.append(str(src_file))
+                # Symlinked directories are followed, as when they are copied
+                for root, dirs, filenames in os.walk(src_file, followlinks=True):
+                    dirs.sort()
+                    files.extend(os.path.join(root, name) for name in sorted(dirs + filenames))
+
+        for path in files:
+            try:
+                stat = os.stat(path) if path else None
+            except OSError:
+                stat = None
+            inputs.append([path, stat and [stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_mode]])
+
+        return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+    def context_digest(self) -> str:
+        """
+        Return a digest of the contents of the build context, including the
+        generated Containerfile. File contents are looked up in the context
+        manifest, so only files that changed since they were written are read.
+        """
+        manifest = ContextManifest(os.path.join(self.build_context, constants.context_manifest_file))
+        skip = {constants.context_manifest_file, constants.context_fingerprint_file, constants.default_policy_file_name}
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(self.build_context):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                relpath = os.path.relpath(path, self.build_context)
+                if relpath in skip:
+                    continue
+                mode = os.stat(path).st_mode & 0o777
+                digest.update(f'{relpath}\0{mode:o}\0{manifest.file_digest(path)}\0'.encode())
+        return digest.hexdigest()
+
+    def context_is_current(self, fingerprint: str) -> bool:
+        """
+        Return True if the build context was written by a previous run with
+        the same input fingerprint, and is still complete.
+        """
+        try:
+            with open(self.fingerprint_path, 'r') as f:
+                data = json.load(f)
+            if data['fingerprint'] != fingerprint:
+                return False
+            return all(os.path.exists(path) for path in data['paths'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+    def write_fingerprint(self, fingerprint: str) -> None:
+        """Record the input fingerprint and the files written by prepare() and write()"""
+        paths = sorted(self.context_paths | {os.path.abspath(self.path)})
+        with open(self.fingerprint_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'paths': paths}, f)
+
     def _insert_global_args(self, include_values: bool = False) -> None:
         """
         Insert Containerfile ARGs and, possibly, their values.
@@ -221,20 +385,20 @@ class Containerfile:
         # ARGs will be output in the order listed below. Keys with value `None` will be omitted, but empty string values
         # will still appear in the output (this allows them to be set at runtime).
         global_args = {
-            'EE_BASE_IMAGE': self.definition.build_arg_defaults['EE_BASE_IMAGE'],
+            'EE_BASE_IMAGE': self.definition.get_build_arg('EE_BASE_IMAGE'),
             # this is only applicable for < v3 definitions and will be removed elsewhere for newer schema
-            'EE_BUILDER_IMAGE': self.definition.build_arg_defaults['EE_BUILDER_IMAGE'],
+            'EE_BUILDER_IMAGE': self.definition.get_build_arg('EE_BUILDER_IMAGE'),
             'PYCMD': self.definition.python_path or '/usr/bin/python3',
             'PYPKG': self.definition.python_package_system,
-            'PKGMGR_PRESERVE_CACHE': self.definition.build_arg_defaults['PKGMGR_PRESERVE_CACHE'],
+            'PKGMGR_PRESERVE_CACHE': self.definition.get_build_arg('PKGMGR_PRESERVE_CACHE'),
             'ANSIBLE_GALAXY_CLI_COLLECTION_OPTS':
-                self.definition.build_arg_defaults['ANSIBLE_GALAXY_CLI_COLLECTION_OPTS'],
-            'ANSIBLE_GALAXY_CLI_ROLE_OPTS': self.definition.build_arg_defaults['ANSIBLE_GALAXY_CLI_ROLE_OPTS'],
+                self.definition.get_build_arg('ANSIBLE_GALAXY_CLI_COLLECTION_OPTS'),
+            'ANSIBLE_GALAXY_CLI_ROLE_OPTS': self.definition.get_build_arg('ANSIBLE_GALAXY_CLI_ROLE_OPTS'),
             'ANSIBLE_INSTALL_REFS': self.definition.ansible_ref_install_list,
         }
 
-        if self.definition.version >= 3:
-            global_args['PKGMGR'] = self.definition.options['package_manager_path']
+        if self.definition.package_manager_path is not None:
+            global_args['PKGMGR'] = self.definition.package_manager_path
 
         for arg, value in global_args.items():
             if value is None:
@@ -253,35 +417,41 @@ class Containerfile:
         """
         scripts_dir = str(Path(self.build_outputs_dir) / 'scripts')
         os.makedirs(scripts_dir, exist_ok=True)
+        self.context_paths.add(os.path.abspath(scripts_dir))
+        manifest = ContextManifest(os.path.join(self.build_context, constants.context_manifest_file))
 
         for item, new_name in constants.CONTEXT_FILES.items():
             # HACK: new dynamic base/builder
             if not new_name:
                 continue
 
-            requirement_path = self.definition.get_dep_abs_path(item)
-            if requirement_path is None:
+            dependency = self.definition.get_dependency(item)
+            if dependency is None:
                 continue
             dest = os.path.join(
                 self.build_context, constants.user_content_subfolder, new_name)
 
-            # Ignore modification time of the requirement file because we could
-            # be writing it out dynamically (inline EE reqs), and we only care
-            # about the contents anyway.
-            copy_file(requirement_path, dest, ignore_mtime=True)
+            if dependency.path is not None:
+                # Ignore modification time of the requirement file because we
+                # only care about the contents.
+                self._copy_to_context(dependency.path, dest, manifest, ignore_mtime=True)
+            elif dependency.content is not None:
+                self._write_to_context(dependency.content, dest)
 
         if self.original_galaxy_keyring:
-            copy_file(
+            self._copy_to_context(
                 self.original_galaxy_keyring,
-                os.path.join(self.build_outputs_dir, constants.default_keyring_name)
+                os.path.join(self.build_outputs_dir, constants.default_keyring_name),
+                manifest,
             )
 
-        self._handle_additional_build_files()
+        self._handle_additional_build_files(manifest)
 
         if self.definition.ansible_config:
-            copy_file(
+            self._copy_to_context(
                 self.definition.ansible_config,
-                os.path.join(self.build_outputs_dir, 'ansible.cfg')
+                os.path.join(self.build_outputs_dir, 'ansible.cfg'),
+                manifest,
             )
 
         # HACK: this sucks
@@ -292,7 +462,9 @@ class Containerfile:
         )
         for script in script_files:
             with importlib.resources.as_file(scriptres / script) as script_path:
-                copy_file(str(script_path), os.path.join(scripts_dir, script))
+                self._copy_to_context(str(script_path), os.path.join(scripts_dir, script), manifest)
+
+        manifest.save()
 
         # Later intermediate stages depend on base image containing these scripts.
         # Copy them to a location that we do not need in the final image.
@@ -303,7 +475,59 @@ class Containerfile:
         # to retain in that image.
         self.steps.append(f'COPY {context_dir}/scripts/entrypoint {constants.FINAL_IMAGE_BIN_PATH}/entrypoint')
 
-    def _handle_additional_build_files(self) -> None:
+    def _copy_to_context(self, source: str, dest: str, manifest: ContextManifest, ignore_mtime: bool = False) -> None:
+        self.context_paths.add(os.path.abspath(dest))
+        copy_file(source, dest, ignore_mtime=ignore_mtime, manifest=manifest, mode=self.context_copy_mode)
+
+    def _write_to_context(self, content: str, dest: str) -> None:
+        """
+        Write content declared inline in the EE file to the build context,
+        unless the file is already up-to-date.
+        """
+        self.context_paths.add(os.path.abspath(dest))
+        try:
+            with open(dest, 'r') as f:
+                if f.read() == content:
+                    logger.debug("File %s is already up-to-date.", dest)
+                    return
+            # The file may be a hard link to a file outside of the build context
+            os.unlink(dest)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, 'w') as f:
+            f.write(content)
+
+    def _prune_build_outputs_dir(self) -> None:
+        """
+        Remove the files and directories in the build outputs directory that
+        were not produced by this run, so that they are not sent to the
+        container runtime with the rest of the build context.
+        """
+        keep = set(self.context_paths)
+        root = os.path.abspath(self.build_outputs_dir)
+        for path in self.context_paths:
+            # keep the parent directories of everything produced
+            while (path := os.path.dirname(path)).startswith(root + os.sep):
+                keep.add(path)
+
+        for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if path not in keep:
+                    logger.debug('Removing stale build context file %s', path)
+                    os.unlink(path)
+            for name in dirnames:
+                path = os.path.join(dirpath, name)
+                if path in keep:
+                    continue
+                if os.path.islink(path):
+                    logger.debug('Removing stale build context file %s', path)
+                    os.unlink(path)
+                elif not os.listdir(path):
+                    logger.debug('Removing stale build context directory %s', path)
+                    os.rmdir(path)
+
+    def _handle_additional_build_files(self, manifest: ContextManifest | None = None) -> None:
         """
         Deal with any files the user wants added to the image build context.
 
@@ -311,10 +535,14 @@ class Containerfile:
         EE definition file. For example, 'src' can be a relative path like
         "data_files/configs/*.cfg", but cannot be "/home/user/files/*.cfg",
         the latter not being relative to the EE.
+
+        Destination directories are created in order, then all the files are
+        compared and copied using up to `copy_jobs` threads.
         """
-        for entry in self.definition.additional_build_files:
-            src = Path(entry['src'])
-            dst = entry['dest']
+        pairs = []
+        dirs: list[str] = []
+        for src_entry, dst in self.definition.additional_build_files:
+            src = Path(src_entry)
 
             # 'src' is either an absolute path or a path glob relative to the EE file
             ee_file = Path(self.definition.filename)
@@ -330,14 +558,104 @@ class Containerfile:
             final_dst = Path(self.build_outputs_dir) / dst
             logger.debug("Creating %s", final_dst)
             final_dst.mkdir(parents=True, exist_ok=True)
+            self.context_paths.add(os.path.abspath(final_dst))
 
             for src_file in src_files:
                 if src_file.is_dir():
-                    copy_directory(src_file, final_dst)
+                    pairs.extend(directory_file_pairs(src_file, final_dst, dirs=dirs))
                 else:
                     # Destination is the subdir under context plus the basename of the source
                     copy_location = final_dst / src_file.name
-                    copy_file(str(src_file), str(copy_location))
+                    pairs.append((str(src_file), str(copy_location)))
+
+        self.context_paths.update(os.path.abspath(path) for path in dirs)
+        self.context_paths.update(os.path.abspath(dest) for dummy, dest in pairs)
+        copy_files(pairs, manifest=manifest, jobs=self.copy_jobs, mode=self.context_copy_mode)
+
+    def _run_host_introspection(self) -> None:
+        """
+        Install the collections into a host cache directory and introspect
+        their requirements, combined with the user requirements, on the host.
+
+        The combined requirements files are written to the build context, so
+        that the builder stage no longer needs the collections installed by the
+        galaxy stage, and container runtimes can build both stages in parallel.
+        """
+        collections_dir = None
+        if self.definition.get_dependency('galaxy'):
+            galaxy_file = os.path.join(self.build_outputs_dir, constants.CONTEXT_FILES['galaxy'])
+            collections_dir = self._install_host_collections(galaxy_file)
+            logger.debug('Introspecting collections installed from %s in %s', galaxy_file, collections_dir)
+
+        user_files = {}
+        for item in ('python', 'system'):
+            user_file = os.path.join(self.build_outputs_dir, constants.CONTEXT_FILES[item])
+            user_files[item] = user_file if os.path.exists(user_file) else None
+
+        # Collections that did not change since a previous run are not read again
+        cache = IntrospectionCache(get_cache_dir('introspect')) if collections_dir else None
+        data = process(collections_dir, user_pip=user_files['python'], user_bindep=user_files['system'], cache=cache)
+
+        try:
+            introspected = {
+                constants.CONTEXT_FILES['python']: sanitize_requirements(data['python']),
+                constants.CONTEXT_FILES['system']: simple_combine(data['system']),
+                constants.upper_constraints_file: simple_combine(data.get('constraints', {})),
+            }
+        except RequirementsConflictError as e:
+            raise DefinitionError(str(e)) from e
+
+        os.makedirs(self.host_introspect_dir, exist_ok=True)
+        for filename, lines in introspected.items():
+            dest = os.path.join(self.host_introspect_dir, filename)
+            if lines:
+                write_file(dest, lines + [''])
+                self.context_paths.add(os.path.abspath(dest))
+            elif os.path.exists(dest):
+                # Requirements from a previous run no longer apply
+                os.unlink(dest)
+
+    def _build_arg(self, name: str) -> str | None:
+        """Return the value of a build argument, as the container runtime would see it"""
+        if name in self.build_args:
+            value = self.build_args[name]
+            return os.environ.get(name) if value is None else value
+        return self.definition.get_build_arg(name)
+
+    def _install_host_collections(self, galaxy_file: str) -> str:
+        """
+        Install the collections from a galaxy requirements file into a host cache
+        directory specific to the contents of that file, and return its path.
+        """
+        with open(galaxy_file, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        collections_dir = get_cache_dir('collections', digest)
+
+        # Upgrade the collections installed by a previous run, like the galaxy
+        # stage would install the latest versions allowed by the requirements.
+        command = [
+            'ansible-galaxy', 'collection', 'install',
+            '-r', galaxy_file,
+            '--collections-path', collections_dir,
+            '--upgrade',
+        ]
+        command.extend(shlex.split(self._build_arg('ANSIBLE_GALAXY_CLI_COLLECTION_OPTS') or ''))
+
+        for code in self.galaxy_ignore_signature_status_codes or []:
+            command.extend(['--ignore-signature-status-code', str(code)])
+        if self.galaxy_required_valid_signature_count:
+            command.extend(['--required-valid-signature-count', str(self.galaxy_required_valid_signature_count)])
+
+        env = {}
+        if self.original_galaxy_keyring:
+            command.extend(['--keyring', self.original_galaxy_keyring])
+        else:
+            env['ANSIBLE_GALAXY_DISABLE_GPG_VERIFY'] = '1'
+        if self.definition.ansible_config:
+            env['ANSIBLE_CONFIG'] = os.path.abspath(self.definition.ansible_config)
+
+        run_command(command, env=env)
+        return collections_dir
 
     def _prepare_ansible_config_file(self) -> None:
         if self.definition.version != 1:
@@ -352,16 +670,49 @@ class Containerfile:
                 "",
             ])
 
+    def _cache_mount_opts(self, *caches: str) -> str:
+        """
+        Return the RUN options mounting the given build caches ('pip', 'pkgmgr',
+        'galaxy' or 'introspect'), or an empty string if cache mounts are not used.
+        """
+        if not self.cache_mounts:
+            return ''
+        mounts = []
+        for cache in caches:
+            if cache == 'pip':
+                mounts.append(f'--mount=type=cache,id=ansible-builder-pip,target={constants.pip_cache_mount}')
+            elif cache == 'galaxy':
+                mounts.append(f'--mount=type=cache,id=ansible-builder-galaxy,target={constants.galaxy_cache_mount}')
+            elif cache == 'introspect':
+                mounts.append(
+                    f'--mount=type=cache,id=ansible-builder-introspect,target={constants.introspect_cache_mount}'
+                )
+            elif cache == 'pkgmgr':
+                # The package managers do not support concurrent use of their cache
+                for target in constants.pkgmgr_cache_mounts:
+                    name = os.path.basename(target)
+                    mounts.append(f'--mount=type=cache,id=ansible-builder-{name},target={target},sharing=locked')
+        return ''.join(f'{mount} ' for mount in mounts)
+
+    def _pip_install_cmd(self) -> str:
+        if self.cache_mounts:
+            return f'{self._cache_mount_opts("pip")}$PYCMD -m pip install --cache-dir={constants.pip_cache_mount}'
+        return '$PYCMD -m pip install --no-cache-dir'
+
+    def _script_cmd(self, script: str) -> str:
+        """Return the command running the assemble or install-from-bindep script"""
+        env = []
+        if self.cache_mounts:
+            # The package manager cache is in the cache mount, not in the image, so it is kept.
+            env.extend([f'PIP_CACHE_MOUNT={constants.pip_cache_mount}', 'PKGMGR_PRESERVE_CACHE=always'])
+        if self.single_python_install:
+            if script == 'assemble':
+                env.append(f'BUILDER_TOOLS={constants.builder_tools_path}')
+            env.append(f'PYTHON_INSTALL_ROOT={constants.python_install_root}')
+        return self._cache_mount_opts("pip", "pkgmgr") + ''.join(f'{var} ' for var in env) + f'/output/scripts/{script}'
+
     def _insert_custom_steps(self, section: str) -> None:
-        additional_steps = self.definition.additional_build_steps
-        if additional_steps:
-            section_steps = additional_steps.get(section)
-            if section_steps:
-                if isinstance(section_steps, str):
-                    lines = section_steps.strip().splitlines()
-                else:
-                    lines = section_steps
-                self.steps.extend(lines)
+        self.steps.extend(self.definition.get_build_steps(section))
 
     def _relax_etc_passwd_permissions(self) -> None:
         self.steps.append(
@@ -383,13 +734,83 @@ class Containerfile:
             "LABEL ansible-execution-environment=true",
         ])
 
+    def _galaxy_requirements_are_remote(self) -> bool:
+        """
+        Return True if the galaxy requirements only refer to remote content, so
+        that no other file from the build context is needed to install them.
+        """
+        try:
+            with open(os.path.join(self.build_outputs_dir, constants.CONTEXT_FILES['galaxy']), 'r') as f:
+                requirements = yaml_safe_load(f)
+        except (OSError, ValueError, yaml.YAMLError):
+            # Let ansible-galaxy report the errors in the requirements file
+            return False
+
+        if isinstance(requirements, list):
+            # old-style roles-only requirements file
+            requirements = {'roles': requirements}
+        if not isinstance(requirements, dict):
+            return False
+
+        for entry in (requirements.get('collections') or []) + (requirements.get('roles') or []):
+            if isinstance(entry, str):
+                entry = {'name': entry}
+            if not isinstance(entry, dict) or entry.get('type') in ('file', 'dir', 'subdirs'):
+                return False
+            for key in ('name', 'src', 'source'):
+                value = entry.get(key)
+                if not isinstance(value, str):
+                    continue
+                if _is_remote_url(value) or value.startswith('git@'):
+                    continue
+                if '://' in value or value.startswith(('.', '/', '~')) or value.endswith(('.tar.gz', '.tgz')):
+                    return False
+            # Signatures are URLs, or local files given as file:// URIs
+            signatures = entry.get('signatures') or []
+            if not isinstance(signatures, list) or not all(
+                    isinstance(signature, str) and _is_remote_url(signature) for signature in signatures):
+                return False
+        return True
+
+    def _has_requirements(self) -> bool:
+        return any(self.definition.get_dependency(thing) for thing in ('galaxy', 'system', 'python'))
+
     def _prepare_build_context(self) -> None:
-        if any(self.definition.get_dep_abs_path(thing) for thing in ('galaxy', 'system', 'python')):
+        if not self._has_requirements():
+            return
+
+        if self.definition.get_dependency('galaxy') and self._galaxy_requirements_are_remote():
+            # Only copy the files used to install the galaxy requirements, so that
+            # changes to other files do not invalidate the cached install layers.
+            # ansible-galaxy reads the ansible.cfg file, e.g. for Galaxy servers
+            # and tokens, from the current directory.
+            filenames = [constants.CONTEXT_FILES['galaxy']]
+            if self.original_galaxy_keyring:
+                filenames.append(constants.default_keyring_name)
+            if self.definition.ansible_config:
+                filenames.append('ansible.cfg')
+            for filename in filenames:
+                self.steps.append(f"COPY {constants.user_content_subfolder}/{filename} /build/{filename}")
             self.steps.extend([
-                f"COPY {constants.user_content_subfolder} /build",
                 "WORKDIR /build",
                 "",
             ])
+            self.galaxy_context_deferred = True
+            return
+
+        self.steps.extend([
+            f"COPY {constants.user_content_subfolder} /build",
+            "WORKDIR /build",
+            "",
+        ])
+
+    def _prepare_build_context_after_galaxy_install(self) -> None:
+        # The rest of the build context is only needed by custom galaxy stage steps.
+        if self.galaxy_context_deferred and self.definition.get_build_steps('append_galaxy'):
+            self.steps.extend([
+                f"COPY {constants.user_content_subfolder} /build",
+                "",
+            ])
 
     def _prepare_galaxy_install_steps(self) -> None:
         env = ""
@@ -418,46 +839,74 @@ class Containerfile:
             f"-r {constants.CONTEXT_FILES['galaxy']}"
             f" --roles-path \"{constants.base_roles_path}\"",
         )
+        if self.cache_mounts:
+            env = f"{self._cache_mount_opts('galaxy')}ANSIBLE_GALAXY_CACHE_DIR={constants.galaxy_cache_mount} {env}"
         step = f"RUN {env}ansible-galaxy collection install $ANSIBLE_GALAXY_CLI_COLLECTION_OPTS {install_opts}"
         self.steps.append(step)
 
     def _prepare_introspect_assemble_steps(self) -> None:
         # The introspect/assemble block is valid if there are any form of requirements
-        if any(self.definition.get_dep_abs_path(thing) for thing in ('galaxy', 'system', 'python')):
+        if not self._has_requirements():
+            return
 
-            introspect_cmd = "RUN $PYCMD /output/scripts/introspect.py introspect --sanitize"
+        if self.host_introspect:
+            # Requirements were introspected on the host, just put them where assemble expects them.
+            for filename in (constants.CONTEXT_FILES['python'], constants.CONTEXT_FILES['system'],
+                             constants.upper_constraints_file):
+                if os.path.exists(os.path.join(self.host_introspect_dir, filename)):
+                    relative_path = os.path.join(
+                        constants.user_content_subfolder, constants.host_introspect_subfolder, filename
+                    )
+                    self.steps.append(f"COPY {relative_path} /tmp/src/{filename}")
+            self.steps.append(f"RUN {self._script_cmd('assemble')}")
+            return
 
-            requirements_file_exists = os.path.exists(os.path.join(
-                self.build_outputs_dir, constants.CONTEXT_FILES['python']
-            ))
+        env = f"PYTHONPATH={constants.builder_tools_path} " if self.single_python_install else ""
+        mounts = self._cache_mount_opts('introspect')
+        introspect_cmd = f"RUN {mounts}{env}$PYCMD /output/scripts/introspect.py introspect --sanitize"
+        if self.cache_mounts:
+            introspect_cmd += f" --cache-dir={constants.introspect_cache_mount}"
 
-            if requirements_file_exists:
-                relative_requirements_path = os.path.join(
-                    constants.user_content_subfolder,
-                    constants.CONTEXT_FILES['python']
-                )
-                self.steps.append(f"COPY {relative_requirements_path} {constants.CONTEXT_FILES['python']}")
-                # WORKDIR is /build, so we use the (shorter) relative paths there
-                introspect_cmd += f" --user-pip={constants.CONTEXT_FILES['python']}"
-            bindep_exists = os.path.exists(os.path.join(self.build_outputs_dir, constants.CONTEXT_FILES['system']))
-            if bindep_exists:
-                relative_bindep_path = os.path.join(constants.user_content_subfolder, constants.CONTEXT_FILES['system'])
-                self.steps.append(f"COPY {relative_bindep_path} {constants.CONTEXT_FILES['system']}")
-                introspect_cmd += f" --user-bindep={constants.CONTEXT_FILES['system']}"
+        requirements_file_exists = os.path.exists(os.path.join(
+            self.build_outputs_dir, constants.CONTEXT_FILES['python']
+        ))
+
+        if requirements_file_exists:
+            relative_requirements_path = os.path.join(
+                constants.user_content_subfolder,
+                constants.CONTEXT_FILES['python']
+            )
+            self.steps.append(f"COPY {relative_requirements_path} {constants.CONTEXT_FILES['python']}")
+            # WORKDIR is /build, so we use the (shorter) relative paths there
+            introspect_cmd += f" --user-pip={constants.CONTEXT_FILES['python']}"
+        bindep_exists = os.path.exists(os.path.join(self.build_outputs_dir, constants.CONTEXT_FILES['system']))
+        if bindep_exists:
+            relative_bindep_path = os.path.join(constants.user_content_subfolder, constants.CONTEXT_FILES['system'])
+            self.steps.append(f"COPY {relative_bindep_path} {constants.CONTEXT_FILES['system']}")
+            introspect_cmd += f" --user-bindep={constants.CONTEXT_FILES['system']}"
 
-            introspect_cmd += " --write-bindep=/tmp/src/bindep.txt --write-pip=/tmp/src/requirements.txt"
+        introspect_cmd += " --write-bindep=/tmp/src/bindep.txt --write-pip=/tmp/src/requirements.txt"
+        introspect_cmd += f" --write-constraints=/tmp/src/{constants.upper_constraints_file}"
 
-            self.steps.append(introspect_cmd)
-            self.steps.append("RUN /output/scripts/assemble")
+        self.steps.append(introspect_cmd)
+        self.steps.append(f"RUN {self._script_cmd('assemble')}")
 
     def _prepare_system_runtime_deps_steps(self) -> None:
-        self.steps.extend([
-            "COPY --from=builder /output/ /output/",
-            "RUN /output/scripts/install-from-bindep && rm -rf /output/wheels",
-        ])
+        if self.mount_builder_output:
+            # The builder output, wheels included, is only available while the script runs, and is
+            # never part of a layer of the final image. The mount is writable, but changes are discarded.
+            mount = "--mount=type=bind,from=builder,source=/output,target=/output,rw"
+            self.steps.append(f"RUN {mount} {self._script_cmd('install-from-bindep')}")
+        else:
+            self.steps.extend([
+                "COPY --from=builder /output/ /output/",
+                f"RUN {self._script_cmd('install-from-bindep')} && rm -rf /output/wheels",
+            ])
+        if self.single_python_install and self._has_requirements():
+            self.steps.append(f"COPY --from=builder {constants.python_install_root}/ /")
 
     def _prepare_galaxy_copy_steps(self) -> None:
-        if self.definition.get_dep_abs_path('galaxy'):
+        if self.definition.get_dependency('galaxy'):
             dir_name = os.path.dirname(constants.base_collections_path.rstrip('/'))  # /usr/share/ansible
             self.steps.extend([
                 "",
@@ -466,9 +915,9 @@ class Containerfile:
             ])
 
     def _prepare_entrypoint_steps(self) -> None:
-        if ep := self.definition.container_init.get('entrypoint'):
+        if ep := self.definition.init_entrypoint:
             self.steps.append(f"ENTRYPOINT {ep}")
-        if cmd := self.definition.container_init.get('cmd'):
+        if cmd := self.definition.init_cmd:
             self.steps.append(f"CMD {cmd}")
 
     def _prepare_user_steps(self, uid) -> None:
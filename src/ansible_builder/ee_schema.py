@@ -1,6 +1,9 @@
+import functools
 import os
 
-from jsonschema import validate, SchemaError, ValidationError
+from jsonschema import SchemaError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 from ansible_builder import constants
 from ansible_builder.exceptions import DefinitionError
@@ -345,6 +348,20 @@ schema_v3 = {
                     "description": "Disables the installation of pip in the base image",
                     "type": "boolean",
                 },
+                "single_python_install": {
+                    "description": "Install the Python requirements in the builder stage only, and copy them "
+                                   "into the final image",
+                    "type": "boolean",
+                },
+                "mount_builder_output": {
+                    "description": "Bind mount the builder stage output in the final stage instead of copying it",
+                    "type": "boolean",
+                },
+                "cache_mounts": {
+                    "description": "Use build cache mounts for pip and package manager downloads, and galaxy "
+                                   "server responses",
+                    "type": "boolean",
+                },
                 "workdir": {
                     "description": "Default working directory, also often the homedir for ephemeral UIDs",
                     "type": ["string", "null"],
@@ -391,6 +408,18 @@ schema_v3 = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def get_validator(schema_version: int):
+    """
+    Return the validator for a schema version. The validators are created, and
+    the schemas themselves checked, only once per process.
+    """
+    schema = {1: schema_v1, 2: schema_v2, 3: schema_v3}[schema_version]
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
 def validate_schema(ee_def: dict):
     schema_version = 1
     if 'version' in ee_def:
@@ -403,15 +432,14 @@ def validate_schema(ee_def: dict):
         raise DefinitionError(f"Unsupported schema version: {schema_version}")
 
     try:
-        if schema_version == 1:
-            validate(instance=ee_def, schema=schema_v1)
-        elif schema_version == 2:
-            validate(instance=ee_def, schema=schema_v2)
-        elif schema_version == 3:
-            validate(instance=ee_def, schema=schema_v3)
-    except (SchemaError, ValidationError) as e:
+        validator = get_validator(schema_version)
+    except SchemaError as e:
         raise DefinitionError(msg=e.message, path=e.absolute_schema_path) from e
 
+    # Report the same error as jsonschema.validate() would
+    if error := best_match(validator.iter_errors(ee_def)):
+        raise DefinitionError(msg=error.message, path=error.absolute_schema_path) from error
+
     _handle_aliasing(ee_def)
 
     if schema_version >= 3:
@@ -449,6 +477,9 @@ def _handle_options_defaults(ee_def: dict):
 
     options.setdefault('skip_ansible_check', False)
     options.setdefault('skip_pip_install', False)
+    options.setdefault('cache_mounts', False)
+    options.setdefault('single_python_install', False)
+    options.setdefault('mount_builder_output', False)
     options.setdefault('relax_passwd_permissions', True)
     options.setdefault('workdir', '/runner')
     options.setdefault('package_manager_path', '/usr/bin/dnf')
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import os
 
@@ -7,7 +9,7 @@ from . import constants
 from .containerfile import Containerfile
 from .policies import PolicyChoices, BaseImagePolicy, IgnoreAll, ExactReference
 from .user_definition import UserDefinition
-from .utils import run_command
+from .utils import detect_container_runtime, get_runtime_capabilities, run_command
 
 
 logger = logging.getLogger(__name__)
@@ -17,10 +19,10 @@ class AnsibleBuilder:
     def __init__(self,
                  action: str,
                  filename: str | None = None,
-                 build_args: dict[str, str] | None = None,
+                 build_args: dict[str, str | None] | None = None,
                  build_context: str = constants.default_build_context,
                  tag: list | None = None,
-                 container_runtime: str = constants.default_container_runtime,
+                 container_runtime: str | None = None,
                  output_filename: str | None = None,
                  no_cache: bool = False,
                  prune_images: bool = False,
@@ -31,6 +33,11 @@ class AnsibleBuilder:
                  container_policy: str | None = None,
                  container_keyring: str | None = None,
                  squash: str | None = None,
+                 host_introspect: bool = False,
+                 copy_jobs: int = 1,
+                 context_copy_mode: str = constants.default_context_copy_mode,
+                 prune_context: bool = False,
+                 cache_mounts: bool = False,
                  ) -> None:
         """
         Initialize the AnsibleBuilder object.
@@ -40,7 +47,8 @@ class AnsibleBuilder:
         :param dict build_args: Dictionary of build args to consider.
         :param str build_context: Name of the build context directory.
         :param list tag: List of tag names to apply to resulting image.
-        :param str container_runtime: Name of the container runtime in use.
+        :param str container_runtime: Name of the container runtime in use. Defaults to podman
+            if it is installed, otherwise docker.
         :param str output_filename: Name of the resulting instruction file. If not supplied, it
             will default to a value based on container_runtime.
         :param bool no_cache: If True, will not use the build cache when building an image.
@@ -54,6 +62,13 @@ class AnsibleBuilder:
         :param str container_policy: The container validation policy. A valid string value from the PolicyChoices enum.
         :param str container_keyring: GPG keyring for container image validation.
         :param str squash: With podman, controls layer squashing.
+        :param bool host_introspect: If True, collection requirements are introspected on the host
+            instead of in the builder stage of the image build.
+        :param int copy_jobs: Number of files to compare and copy into the build context concurrently.
+        :param str context_copy_mode: How files are copied into the build context: copy, reflink, hardlink or auto.
+        :param bool prune_context: If True, remove files from the build context that were not produced by this run.
+        :param bool cache_mounts: If True, use build cache mounts for the pip and package manager downloads,
+            and the galaxy server response cache.
         """
 
         if not galaxy_keyring and (galaxy_required_valid_signature_count or galaxy_ignore_signature_status_codes):
@@ -65,15 +80,16 @@ class AnsibleBuilder:
         self.action = action
 
         # Read and validate the EE file early
-        self.definition = UserDefinition(filename=filename)
-        self.definition.validate()
+        definition = UserDefinition(filename=filename)
+        definition.validate()
+        self.definition = definition.resolved
 
         if self.definition.version < 3:
             logger.warning('Found version %s, consider upgrading to version 3 or above', self.definition.version)
 
         self.tags = [constants.default_tag]
-        if self.definition.version >= 3 and self.definition.options['tags']:
-            self.tags = self.definition.options['tags']
+        if self.definition.tags:
+            self.tags = list(self.definition.tags)
 
         if tag:
             self.tags = tag
@@ -81,10 +97,11 @@ class AnsibleBuilder:
         self.build_context = build_context
         self.build_outputs_dir = os.path.join(
             build_context, constants.user_content_subfolder)
-        self.container_runtime = container_runtime
+        self.container_runtime = container_runtime or detect_container_runtime()
         self.build_args = build_args or {}
         self.no_cache = no_cache
         self.prune_images = prune_images
+        self.input_digest: str | None = None
 
         self.containerfile = Containerfile(
             definition=self.definition,
@@ -93,7 +110,13 @@ class AnsibleBuilder:
             output_filename=output_filename,
             galaxy_keyring=galaxy_keyring,
             galaxy_required_valid_signature_count=galaxy_required_valid_signature_count,
-            galaxy_ignore_signature_status_codes=galaxy_ignore_signature_status_codes)
+            galaxy_ignore_signature_status_codes=galaxy_ignore_signature_status_codes,
+            host_introspect=host_introspect,
+            copy_jobs=copy_jobs,
+            context_copy_mode=context_copy_mode,
+            prune_context=prune_context,
+            cache_mounts=cache_mounts,
+            build_args=self.build_args)
 
         self.verbosity = verbosity
         self.container_policy, self.container_keyring = self._handle_image_validation_opts(
@@ -166,13 +189,21 @@ class AnsibleBuilder:
         return self.definition.version
 
     @property
-    def ansible_config(self) -> str:
+    def ansible_config(self) -> str | None:
         return self.definition.ansible_config
 
     def create(self) -> bool:
+        # Skip the work if nothing changed since the build context was last created.
+        # The no_cache option also bypasses this cache.
+        fingerprint = self.containerfile.input_fingerprint()
+        if not self.no_cache and self.containerfile.context_is_current(fingerprint):
+            logger.debug('The execution environment build context is already up-to-date.')
+            return True
+
         logger.debug('Ansible Builder is generating your execution environment build context.')
         self.containerfile.prepare()
         self.containerfile.write()
+        self.containerfile.write_fingerprint(fingerprint)
         return True
 
     @property
@@ -201,6 +232,9 @@ class AnsibleBuilder:
 
             command.append(build_arg)
 
+        if self.input_digest:
+            command.append(f'--label={constants.image_input_digest_label}={self.input_digest}')
+
         if self.no_cache:
             command.append('--no-cache')
 
@@ -244,8 +278,59 @@ class AnsibleBuilder:
 
         return command
 
+    def image_input_digest(self) -> str:
+        """
+        Return a digest of the build context and the options that affect the
+        image built from it. Built images are labeled with this digest.
+        """
+        digest = hashlib.sha256(self.containerfile.context_digest().encode())
+        # A build argument without a value takes it from the environment, see Containerfile._build_arg()
+        build_args = sorted((name, os.environ.get(name) if value is None else value)
+                            for name, value in self.build_args.items())
+        options = [self.container_runtime, build_args, self.squash]
+        digest.update(json.dumps(options).encode())
+        return digest.hexdigest()
+
+    def find_image(self) -> str | None:
+        """Return the ID of a local image built from the same inputs, if there is one"""
+        rc, output = run_command(
+            [self.container_runtime, 'images', '-q',
+             '--filter', f'label={constants.image_input_digest_label}={self.input_digest}'],
+            capture_output=True, allow_error=True)
+        if rc != 0:
+            return None
+        image_ids = [line.strip() for line in output if line.strip()]
+        return image_ids[0] if image_ids else None
+
+    def check_runtime_capabilities(self) -> None:
+        """Warn about build instructions that the container runtime is known not to support"""
+        if not (self.containerfile.cache_mounts or self.containerfile.mount_builder_output):
+            return
+        capabilities = get_runtime_capabilities(self.container_runtime)
+        if not capabilities:
+            return  # unknown, let the build itself fail if needed
+        buildkit_disabled = self.container_runtime == 'docker' and os.environ.get('DOCKER_BUILDKIT') == '0'
+        if not capabilities['mounts'] or buildkit_disabled:
+            logger.warning('%s %s does not support the RUN --mount instructions used by the cache_mounts and '
+                           'mount_builder_output options, the build may fail.',
+                           self.container_runtime, capabilities['version'])
+
     def build(self) -> bool:
         self.create()
+        self.check_runtime_capabilities()
+        self.input_digest = self.image_input_digest()
+
+        # An image built from the same inputs only needs to be tagged. Images are
+        # always built when a container policy is used, so that the base images
+        # are pulled and validated.
+        if not self.no_cache and not self.container_policy:
+            image_id = self.find_image()
+            if image_id:
+                logger.debug('Found image %s built from the same inputs. Tags: %s', image_id, ", ".join(self.tags))
+                for tag in self.tags:
+                    run_command([self.container_runtime, 'tag', image_id, tag])
+                return True
+
         logger.debug('Ansible Builder is building your execution environment image. Tags: %s', ", ".join(self.tags))
         run_command(self.build_command)
         if self.prune_images:
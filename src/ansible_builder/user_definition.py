@@ -4,14 +4,16 @@ import logging
 import os
 import textwrap
 import tempfile
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Callable
+from typing import Any, Callable, NamedTuple
 
 import yaml
 
 from . import constants
 from .exceptions import DefinitionError
 from .ee_schema import validate_schema
+from .utils import yaml_safe_dump, yaml_safe_load
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +21,86 @@ logger = logging.getLogger(__name__)
 _tempfiles: list[Callable] = []
 
 
+@dataclass(frozen=True)
+class ResolvedDependency:
+    """
+    A dependency file from the EE definition.
+
+    Dependency files are either referenced by their absolute path, or declared
+    inline in the EE file, in which case ``content`` is the text of the file.
+    """
+
+    path: str | None = None
+    content: str | None = None
+
+
+class ResolvedImage(NamedTuple):
+    """A container image from the 'images' section of the EE file."""
+
+    name: str
+    signature_original_name: str | None
+
+
+class ResolvedDefinition(NamedTuple):
+    """
+    An immutable view of a validated EE definition, computed once.
+
+    Unlike UserDefinition, values are looked up without walking the raw
+    definition, and instances are hashable and cheap to pickle. Mappings and
+    lists of the EE file are stored as tuples.
+
+    The options of version 3 definitions have their defaults applied. For
+    older versions, they have the value that disables the matching feature.
+    """
+
+    filename: str
+    version: int
+    ansible_config: str | None
+    python_package_system: str | None
+    python_path: str | None
+    ansible_ref_install_list: str | None
+    base_image: ResolvedImage | None
+    builder_image: ResolvedImage | None
+    # (name, value) pairs
+    build_arg_defaults: tuple[tuple[str, Any], ...]
+    # (section, lines) pairs
+    additional_build_steps: tuple[tuple[str, tuple[str, ...]], ...]
+    # (src, dest) pairs
+    additional_build_files: tuple[tuple[str, str], ...]
+    galaxy_dependency: ResolvedDependency | None
+    python_dependency: ResolvedDependency | None
+    system_dependency: ResolvedDependency | None
+    init_package_pip: str | None
+    init_entrypoint: str | None
+    init_cmd: str | None
+    skip_ansible_check: bool
+    skip_pip_install: bool
+    cache_mounts: bool
+    single_python_install: bool
+    mount_builder_output: bool
+    relax_passwd_permissions: bool
+    workdir: str | None
+    package_manager_path: str | None
+    user: str | None
+    tags: tuple[str, ...]
+
+    def get_dependency(self, entry: str) -> ResolvedDependency | None:
+        """Return the 'galaxy', 'python' or 'system' dependency file, if any."""
+        return getattr(self, f'{entry}_dependency')
+
+    def get_build_arg(self, name: str) -> Any:
+        for key, value in self.build_arg_defaults:
+            if key == name:
+                return value
+        raise KeyError(name)
+
+    def get_build_steps(self, section: str) -> tuple[str, ...]:
+        for key, lines in self.additional_build_steps:
+            if key == section:
+                return lines
+        return ()
+
+
 class ImageDescription:
     """
     Class to describe a container image from the EE file.
@@ -96,7 +178,7 @@ class UserDefinition:
 
         try:
             with open(self.filename, 'r') as ee_file:
-                data = yaml.safe_load(ee_file)
+                data = yaml_safe_load(ee_file)
                 self.raw = data if data else {}
         except FileNotFoundError as exc:
             raise DefinitionError(textwrap.dedent(
@@ -123,6 +205,12 @@ class UserDefinition:
         self.base_image = None
         self.builder_image = None
 
+        # Resolved dependencies (and inline dependencies written to temporary
+        # files), keyed by entry, along with the raw value they were resolved from.
+        self._dependencies = {}
+        self._inline_files = {}
+        self._resolved = None
+
     @property
     def version(self):
         """
@@ -179,40 +267,116 @@ class UserDefinition:
     def options(self):
         return self.raw.get('options', {})
 
+    def _resolve_dependency(self, req_file) -> ResolvedDependency | None:
+        if not req_file:
+            return None
+
+        if isinstance(req_file, dict):
+            return ResolvedDependency(content=yaml_safe_dump(req_file))
+        if isinstance(req_file, list):
+            return ResolvedDependency(content='\n'.join(req_file))
+        if not isinstance(req_file, str):
+            return None
+        if '\n' in req_file:
+            return ResolvedDependency(content=req_file)
+
+        return ResolvedDependency(path=os.path.join(self.reference_path, req_file))
+
+    def get_dependency(self, entry) -> ResolvedDependency | None:
+        """
+        Return the dependency file for an entry of the 'dependencies' section,
+        or None if there is no such file.
+
+        Files can be referenced by either an absolute path or a path relative
+        to the EE definition folder, or declared inline. The result is resolved
+        once, unless the entry is changed.
+        """
+        req_file = self.raw.get('dependencies', {}).get(entry)
+        cached = self._dependencies.get(entry)
+        if cached is None or cached[0] is not req_file:
+            cached = (req_file, self._resolve_dependency(req_file))
+            self._dependencies[entry] = cached
+        return cached[1]
+
     def get_dep_abs_path(self, entry):
         """Unique to the user EE definition, files can be referenced by either
         an absolute path or a path relative to the EE definition folder
         This method will return the absolute path.
+
+        Inline dependencies are written to a temporary file, once.
         """
-        req_file = self.raw.get('dependencies', {}).get(entry)
+        dependency = self.get_dependency(entry)
 
-        if not req_file:
+        if dependency is None:
             return None
+        if dependency.path is not None:
+            return dependency.path
 
-        # dump inline-declared deps to files that will be injected directly into the generated context
-        if isinstance(req_file, dict):
-            tf = tempfile.NamedTemporaryFile('w')
-            tf.write(yaml.safe_dump(req_file))
-            tf.flush()  # don't close, it'll clean up on GC
-            _tempfiles.append(tf)
-            req_file = tf.name
-        elif (is_list := isinstance(req_file, list)) or (isinstance(req_file, str) and '\n' in req_file):
+        cached = self._inline_files.get(entry)
+        if cached is None or cached[0] is not dependency:
             # pylint: disable=R1732
             tf = tempfile.NamedTemporaryFile('w')
-            if is_list:
-                tf.write('\n'.join(req_file))
-            else:
-                tf.write(req_file)
-            _tempfiles.append(tf)
+            tf.write(dependency.content)
             tf.flush()  # don't close, it'll clean up on GC
-            req_file = tf.name
-        if not isinstance(req_file, str):
-            return None
-
-        if os.path.isabs(req_file):
-            return req_file
+            _tempfiles.append(tf)
+            cached = (dependency, tf.name)
+            self._inline_files[entry] = cached
+        return cached[1]
 
-        return os.path.join(self.reference_path, req_file)
+    @property
+    def resolved(self) -> ResolvedDefinition:
+        """
+        The ResolvedDefinition computed by validate(), or computed from the
+        definition as it is if it was not validated.
+        """
+        if self._resolved is None:
+            self._resolved = self.resolve()
+        return self._resolved
+
+    def resolve(self) -> ResolvedDefinition:
+        """Compute a ResolvedDefinition from the current definition."""
+        options = self.options if self.version >= 3 else {}
+
+        steps = []
+        for section, section_steps in (self.additional_build_steps or {}).items():
+            if isinstance(section_steps, str):
+                section_steps = section_steps.strip().splitlines()
+            steps.append((section, tuple(section_steps)))
+
+        def image(description):
+            if description is None:
+                return None
+            return ResolvedImage(description.name, description.signature_original_name)
+
+        return ResolvedDefinition(
+            filename=self.filename,
+            version=self.version,
+            ansible_config=self.ansible_config,
+            python_package_system=self.python_package_system,
+            python_path=self.python_path,
+            ansible_ref_install_list=self.ansible_ref_install_list,
+            base_image=image(self.base_image),
+            builder_image=image(self.builder_image),
+            build_arg_defaults=tuple(self.build_arg_defaults.items()),
+            additional_build_steps=tuple(steps),
+            additional_build_files=tuple((entry['src'], entry['dest']) for entry in self.additional_build_files),
+            galaxy_dependency=self.get_dependency('galaxy'),
+            python_dependency=self.get_dependency('python'),
+            system_dependency=self.get_dependency('system'),
+            init_package_pip=self.container_init.get('package_pip'),
+            init_entrypoint=self.container_init.get('entrypoint'),
+            init_cmd=self.container_init.get('cmd'),
+            skip_ansible_check=self.version < 3 or bool(options.get('skip_ansible_check')),
+            skip_pip_install=self.version < 3 or bool(options.get('skip_pip_install')),
+            cache_mounts=bool(options.get('cache_mounts')),
+            single_python_install=bool(options.get('single_python_install')),
+            mount_builder_output=bool(options.get('mount_builder_output')),
+            relax_passwd_permissions=bool(options.get('relax_passwd_permissions')),
+            workdir=options.get('workdir'),
+            package_manager_path=options.get('package_manager_path'),
+            user=options.get('user'),
+            tags=tuple(options.get('tags') or ()),
+        )
 
     def _validate_additional_build_files(self):
         """
@@ -240,10 +404,10 @@ class UserDefinition:
             # HACK: non-file deps for dynamic base/builder
             if not value:
                 continue
-            requirement_path = self.get_dep_abs_path(item)
-            if requirement_path:
-                if not os.path.exists(requirement_path):
-                    raise DefinitionError(f"Dependency file {requirement_path} does not exist.")
+            dependency = self.get_dependency(item)
+            if dependency and dependency.path is not None:
+                if not os.path.exists(dependency.path):
+                    raise DefinitionError(f"Dependency file {dependency.path} does not exist.")
 
         # Validate and set any user-specified build arguments
         build_arg_defaults = self.raw.get('build_arg_defaults')
@@ -282,3 +446,5 @@ class UserDefinition:
                             logging.warning(
                                 "Found USER directive in '%s' in 'additional_build_steps'. "
                                 "Including this directive may cause failures in the build process.", step_name)
+
+        self._resolved = self.resolve()
@@ -1,19 +1,39 @@
+from __future__ import annotations
+
+import errno
+import fcntl
 import filecmp
+import functools
+import hashlib
+import itertools
+import json
 import logging
 import logging.config
 import os
 import shutil
 import subprocess
 import sys
+import time
 
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import yaml
+
 from .colors import MessageColors
 from . import constants
 
+try:
+    from yaml import CSafeDumper as YamlDumper, CSafeLoader as YamlLoader
+except ImportError:  # PyYAML was built without libyaml
+    from yaml import SafeDumper as YamlDumper, SafeLoader as YamlLoader  # type: ignore[assignment]
+
 
 logger = logging.getLogger(__name__)
+
+# Linux ioctl request that makes a file share the data of another one (see ioctl_ficlone(2))
+FICLONE = 0x40049409
 logging_levels = {
     '0': 'ERROR',
     '1': 'WARNING',
@@ -63,14 +83,17 @@ def configure_logger(verbosity):
     logging.config.dictConfig(LOGGING)
 
 
-def run_command(command, capture_output=False, allow_error=False):
+def run_command(command, capture_output=False, allow_error=False, env=None):
     logger.info('Running command:')
     logger.info('  %s', ' '.join(command))
+    if env:
+        env = {**os.environ, **env}
     try:
         # pylint: disable=R1732
         process = subprocess.Popen(command,
                                    stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT)
+                                   stderr=subprocess.STDOUT,
+                                   env=env)
     except FileNotFoundError:
         msg = f"You do not have {command[0]} installed."
         if command[0] in constants.runtime_files:
@@ -121,6 +144,118 @@ def run_command(command, capture_output=False, allow_error=False):
     return (rc, output)
 
 
+@functools.lru_cache(maxsize=None)
+def detect_container_runtime() -> str:
+    """Return the default container runtime: podman if it is installed, otherwise docker"""
+    return constants.default_container_runtime
+
+
+def _version_tuple(version: str) -> tuple[int, ...]:
+    parts = []
+    for part in version.split('.'):
+        digits = ''.join(itertools.takewhile(str.isdigit, part))
+        if not digits:
+            break
+        parts.append(int(digits))
+    return tuple(parts)
+
+
+def _probe_runtime(runtime: str) -> dict:
+    """Run `<runtime> version` and derive the capabilities of the runtime from its version"""
+    output_format = 'json' if runtime == 'podman' else '{{json .}}'
+    try:
+        result = subprocess.run([runtime, 'version', '--format', output_format],
+                                capture_output=True, text=True, timeout=60, check=False)
+        version = json.loads(result.stdout)['Client']['Version']
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError, TypeError):
+        return {}
+
+    version_info = _version_tuple(version)
+    if runtime == 'podman':
+        # buildah >= 1.24 supports RUN --mount=type=cache and bind mounts from other stages
+        return {'version': version, 'mounts': version_info >= (4, 0)}
+    # BuildKit, which supports RUN --mount, is the default builder since Docker 23.0
+    return {'version': version, 'mounts': version_info >= (23, 0)}
+
+
+@functools.lru_cache(maxsize=None)
+def get_runtime_capabilities(runtime: str) -> dict:
+    """
+    Return the capabilities of a container runtime, as a dict with the keys:
+
+    - version: the version of the runtime
+    - mounts: whether RUN --mount cache and bind mounts are supported
+
+    An empty dict is returned if the runtime could not be probed. Probing runs the
+    runtime, so the results are cached for the process, and on disk for
+    constants.runtime_capabilities_ttl seconds, keyed by the runtime executable.
+    """
+    path = shutil.which(runtime)
+    if not path:
+        return {}
+    stat = os.stat(path)
+    key = [path, stat.st_size, stat.st_mtime_ns]
+
+    cache_path = get_cache_dir(constants.runtime_capabilities_file)
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+        entry = cache[runtime]
+        if entry['key'] == key and 0 <= time.time() - entry['probed'] < constants.runtime_capabilities_ttl:
+            return entry['capabilities']
+    except (OSError, ValueError, KeyError, TypeError):
+        cache = {}
+    if not isinstance(cache, dict):
+        cache = {}
+
+    capabilities = _probe_runtime(runtime)
+    if capabilities:
+        cache[runtime] = {'key': key, 'probed': time.time(), 'capabilities': capabilities}
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.debug('Unable to write the container runtime capabilities cache: %s', e)
+    return capabilities
+
+
+def get_cache_dir(*subdirs: str) -> str:
+    """
+    Return the path of the per-user ansible-builder cache directory, or of a
+    subdirectory within it. The directory is not created.
+
+    The location honors XDG_CACHE_HOME, defaulting to ~/.cache/ansible-builder.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, constants.user_cache_subfolder, *subdirs)
+
+
+def yaml_safe_load(stream):
+    """
+    Equivalent to yaml.safe_load(), using the libyaml based loader when available.
+
+    The libyaml error messages do not show the offending line, so on a syntax
+    error the document is parsed again with the pure Python loader, which
+    raises the same error with a more helpful message.
+    """
+    try:
+        return yaml.load(stream, Loader=YamlLoader)
+    except yaml.MarkedYAMLError:
+        if YamlLoader is yaml.SafeLoader:
+            raise
+        if hasattr(stream, 'seek'):
+            stream.seek(0)
+        return yaml.load(stream, Loader=yaml.SafeLoader)
+
+
+def yaml_safe_dump(data, stream=None, **kwargs):
+    """Equivalent to yaml.safe_dump(), using the libyaml based dumper when available"""
+    return yaml.dump(data, stream, Dumper=YamlDumper, **kwargs)
+
+
 def write_file(filename: str, lines: list) -> bool:
     parent_dir = os.path.dirname(filename)
     if parent_dir and not os.path.exists(parent_dir):
@@ -138,7 +273,71 @@ def write_file(filename: str, lines: list) -> bool:
     return True
 
 
-def copy_directory(source_dir: Path, dest: Path):
+class ContextManifest:
+    """
+    A persistent record of the contents of the files synced into the build
+    context, so that unchanged files do not need to be read again to know
+    whether they are up-to-date.
+
+    For each source and destination file, the manifest stores its stat
+    signature (size, modification time and inode) along with the SHA-256 of
+    its contents. A file is only hashed again once its signature has changed.
+    Only files used by the latest save() are kept.
+    """
+
+    version = 1
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self._files: dict[str, dict] = {}
+        self._used: dict[str, dict] = {}
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data['version'] == self.version:
+                self._files = data['files']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    @staticmethod
+    def _signature(path: str) -> list:
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def file_digest(self, path: str) -> str:
+        """Return the SHA-256 of a file, hashing it only if it changed since it was last recorded"""
+        path = os.path.abspath(path)
+        signature = self._signature(path)
+        entry = self._files.get(path)
+        if entry is None or entry['signature'] != signature:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                while chunk := f.read(self.chunk_size):
+                    digest.update(chunk)
+            entry = self._files[path] = {'signature': signature, 'sha256': digest.hexdigest()}
+        self._used[path] = entry
+        return entry['sha256']
+
+    def same_contents(self, source: str, dest: str) -> bool:
+        return self.file_digest(source) == self.file_digest(dest)
+
+    def copied(self, source: str, dest: str) -> None:
+        """Record that dest is now a copy of source"""
+        dest = os.path.abspath(dest)
+        self._files[dest] = self._used[dest] = {
+            'signature': self._signature(dest),
+            'sha256': self.file_digest(source),
+        }
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump({'version': self.version, 'files': self._used}, f)
+
+
+def copy_directory(source_dir: Path, dest: Path, manifest: ContextManifest | None = None, jobs: int = 1,
+                   mode: str = 'copy'):
     """
     Recursively copy a source directory to a path in the context directory.
 
@@ -146,22 +345,59 @@ def copy_directory(source_dir: Path, dest: Path):
     attempt to copy files within the source directory to the context directory
     if necessary by utilizing copy_file() on each file, rather than a blind
     recursive copy.
+
+    Subdirectories are created first, in sorted order, after which up to
+    `jobs` files are compared and copied concurrently. See copy_files().
     """
 
     if not source_dir.is_dir():
         raise Exception(f"Expected a directory at '{source_dir}'")
 
-    for child in source_dir.iterdir():
+    copy_files(directory_file_pairs(source_dir, dest), manifest=manifest, jobs=jobs, mode=mode)
+
+
+def directory_file_pairs(source_dir: Path, dest: Path, dirs: list | None = None) -> list[tuple[str, str]]:
+    """
+    Create the subdirectories of a source directory under the destination, and
+    return the (source, dest) pairs of all the files to copy, in sorted order.
+
+    :param dirs list: Optional list to append the paths of the created subdirectories to.
+    """
+    pairs = []
+    for child in sorted(source_dir.iterdir()):
         copy_location = dest / child.name
         if child.is_dir():
             # a subdir of our build destination directory
             copy_location.mkdir(exist_ok=True)
-            copy_directory(child, copy_location)
+            if dirs is not None:
+                dirs.append(str(copy_location))
+            pairs.extend(directory_file_pairs(child, copy_location, dirs=dirs))
         else:
-            copy_file(str(child), str(copy_location))
+            pairs.append((str(child), str(copy_location)))
+    return pairs
+
+
+def copy_files(pairs: list[tuple[str, str]],
+               ignore_mtime: bool = False,
+               manifest: ContextManifest | None = None,
+               jobs: int = 1,
+               mode: str = 'copy') -> list[bool]:
+    """
+    Copy each (source, dest) pair of files as copy_file() would, comparing and
+    copying up to `jobs` files concurrently. Messages are still logged in the
+    order of the pairs, so the output does not depend on the number of jobs.
+
+    :returns: A list with the copy_file() result of each pair.
+    """
+    sync = functools.partial(_sync_file, ignore_mtime=ignore_mtime, manifest=manifest, mode=mode)
+    if jobs > 1 and len(pairs) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return [_log_messages(*result) for result in executor.map(lambda pair: sync(*pair), pairs)]
+    return [_log_messages(*sync(*pair)) for pair in pairs]
 
 
-def copy_file(source: str, dest: str, ignore_mtime: bool = False) -> bool:
+def copy_file(source: str, dest: str, ignore_mtime: bool = False, manifest: ContextManifest | None = None,
+              mode: str = 'copy') -> bool:
     """
     Used to copy a source file to a destination file in the container runtime
     context subfolder.
@@ -173,35 +409,92 @@ def copy_file(source: str, dest: str, ignore_mtime: bool = False) -> bool:
     :param source str: Path to a source file.
     :param dest str: Path to a destination file within the context subdir.
     :param ignore_mtime bool: Whether or not mtime should be considered.
+    :param manifest ContextManifest: Optional manifest of file contents, used
+        instead of comparing the files byte for byte.
+    :param mode str: How the file is copied, one of constants.context_copy_modes.
+        With 'reflink', the copy shares the data of the source file where the
+        filesystem supports it, 'hardlink' links the destination to the source
+        file, and 'auto' tries a reflink first. A plain copy is made whenever
+        this is not possible. In all cases the destination has the modification
+        time of the source, as with a plain copy.
 
     :returns: True if the file was copied, False if not.
 
     :raises: Exception if called with the path to a directory. This helps to
         catch programming errors.
     """
+    return _log_messages(*_sync_file(source, dest, ignore_mtime=ignore_mtime, manifest=manifest, mode=mode))
+
+
+def _log_messages(result, messages: list[tuple]):
+    for level, msg, *args in messages:
+        logger.log(level, msg, *args)
+    return result
+
+
+def _sync_file(source: str, dest: str, ignore_mtime: bool = False,
+               manifest: ContextManifest | None = None, mode: str = 'copy') -> tuple[bool, list[tuple]]:
+    """
+    Implementation of copy_file(), returning its messages to log instead of
+    logging them, so that it can run in a thread pool.
+    """
 
     should_copy = False
+    messages: list[tuple] = []
 
     if os.path.abspath(source) == os.path.abspath(dest):
-        logger.info("File %s was placed in build context by user, leaving unmodified.", dest)
-        return False
+        messages.append((logging.INFO, "File %s was placed in build context by user, leaving unmodified.", dest))
+        return False, messages
     if Path(source).is_dir():
         raise Exception(f"Source {source} can not be a directory. Please use copy_directory instead.")
     if Path(dest).is_dir():
         raise Exception(f"Destination {dest} can not be a directory. Please use copy_directory instead.")
     if not os.path.exists(dest):
-        logger.debug("File %s will be created.", dest)
+        messages.append((logging.DEBUG, "File %s will be created.", dest))
         should_copy = True
-    elif not filecmp.cmp(source, dest, shallow=False):
-        logger.warning('File %s had modifications and will be rewritten', dest)
+    elif os.path.samefile(source, dest):
+        pass  # hard linked into the build context, so always up-to-date
+    elif not (manifest.same_contents(source, dest) if manifest else filecmp.cmp(source, dest, shallow=False)):
+        messages.append((logging.WARNING, 'File %s had modifications and will be rewritten', dest))
         should_copy = True
     elif not ignore_mtime and os.path.getmtime(source) > os.path.getmtime(dest):
-        logger.warning('File %s updated time increased and will be rewritten', dest)
+        messages.append((logging.WARNING, 'File %s updated time increased and will be rewritten', dest))
         should_copy = True
 
     if should_copy:
-        shutil.copy2(source, dest)
+        if fallback := _place_file(source, dest, mode):
+            method = 'hard link' if mode == 'hardlink' else 'reflink'
+            messages.append((logging.DEBUG, "Unable to %s %s (%s), copying it instead.", method, source, fallback))
+        if manifest:
+            manifest.copied(source, dest)
+    else:
+        messages.append((logging.DEBUG, "File %s is already up-to-date.", dest))
+
+    return should_copy, messages
+
+
+def _place_file(source: str, dest: str, mode: str) -> str | None:
+    """
+    Copy a file like shutil.copy2() using the given copy mode, falling back to
+    a plain copy if needed. Returns the reason for falling back, if any.
+    """
+    if os.path.lexists(dest) and (mode == 'hardlink' or os.lstat(dest).st_nlink > 1):
+        # Never write through a hard link, which would modify the source file
+        os.unlink(dest)
+
+    try:
+        if mode == 'hardlink':
+            os.link(source, dest)
+            return None
+        if mode in ('reflink', 'auto'):
+            with open(source, 'rb') as src, open(dest, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(source, dest)
+            return None
+    except OSError as e:
+        reason: str | None = e.strerror or errno.errorcode.get(e.errno, str(e))
     else:
-        logger.debug("File %s is already up-to-date.", dest)
+        reason = None
 
-    return should_copy
+    shutil.copy2(source, dest)
+    return reason
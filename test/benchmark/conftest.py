@@ -0,0 +1,20 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def best_time():
+    """
+    Return a function that runs a callable several times and returns the
+    shortest wall clock time, which is the least noisy measurement available.
+    """
+    def _best_time(func, *args, repeat=3, **kwargs):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    return _best_time
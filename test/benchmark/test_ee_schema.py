@@ -0,0 +1,47 @@
+import copy
+
+import jsonschema
+import pytest
+
+from ansible_builder.ee_schema import schema_v3, validate_schema
+
+
+pytestmark = pytest.mark.benchmark
+
+
+def make_definitions(num_definitions=1_000):
+    definition = {
+        'version': 3,
+        'images': {'base_image': {'name': 'quay.io/ansible/awx-ee:latest'}},
+        'dependencies': {
+            'python': ['pytz', 'requests>=2.0'],
+            'system': ['git [platform:rpm]'],
+            'galaxy': {'collections': [{'name': 'ansible.posix', 'version': '>=1.0.0'}]},
+        },
+        'additional_build_steps': {
+            'prepend_base': ['RUN whoami'],
+            'append_final': ['RUN echo done'],
+        },
+        'options': {'tags': ['ee:latest']},
+    }
+    return [copy.deepcopy(definition) for _ in range(num_definitions)]
+
+
+def validate_all(definitions):
+    for definition in definitions:
+        validate_schema(definition)
+
+
+def validate_all_uncached(definitions):
+    for definition in definitions:
+        jsonschema.validate(instance=definition, schema=schema_v3)
+
+
+def test_validate_many_definitions(best_time):
+    definitions = make_definitions()
+
+    fast_time = best_time(validate_all, definitions)
+    # Uncached validation checks the schema itself for every definition, so one run is enough
+    slow_time = best_time(validate_all_uncached, definitions, repeat=1)
+
+    assert fast_time < slow_time, f'cached validation took {fast_time:.3f}s, uncached validation took {slow_time:.3f}s'
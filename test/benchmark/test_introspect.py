@@ -0,0 +1,82 @@
+import pytest
+
+from ansible_builder._target_scripts import introspect
+from ansible_builder._target_scripts.introspect import process, sanitize_requirements, simple_combine
+
+
+pytestmark = pytest.mark.benchmark
+
+# Linear scaling gives a ratio close to the size ratio (10x); the previous
+# quadratic implementations were well above 50x at these sizes.
+MAX_SCALING_RATIO = 30
+
+
+def make_requirements(num_lines, per_collection=100):
+    """
+    Build a dict of requirement lines keyed by collection name, where every
+    package is requested by two different collections with different specifiers.
+    """
+    num_packages = num_lines // 2
+    reqs = {}
+    for c in range(num_lines // per_collection):
+        reqs[f'ns.col{c}'] = [
+            f'pkg{(c * per_collection + i) % num_packages}>={i % 7}' for i in range(per_collection)
+        ]
+    return reqs
+
+
+@pytest.mark.parametrize('func', (sanitize_requirements, simple_combine))
+def test_requirements_merge_scales_linearly(func, best_time):
+    small = make_requirements(5_000)
+    large = make_requirements(50_000)
+
+    small_time = best_time(func, small)
+    large_time = best_time(func, large, repeat=2)
+
+    assert large_time / small_time < MAX_SCALING_RATIO, (
+        f'{func.__name__}: 5k lines took {small_time:.3f}s, 50k lines took {large_time:.3f}s'
+    )
+
+
+def test_sanitize_requirements_large_output():
+    reqs = make_requirements(50_000)
+    sanitized = sanitize_requirements(reqs)
+
+    assert len(sanitized) == 25_000
+    assert sanitized[0] == 'pkg0>=0,>=0  # from collection ns.col0,ns.col250'
+
+
+def make_collection_tree(root, num_collections, per_namespace=100):
+    """
+    Build an ansible_collections tree where half of the collections have
+    execution environment metadata and the other half have inferred requirements.
+    """
+    for i in range(num_collections):
+        col_path = root / 'ansible_collections' / f'ns{i // per_namespace}' / f'col{i}'
+        col_path.mkdir(parents=True)
+        (col_path / 'MANIFEST.json').write_text('{}')
+        if i % 2:
+            (col_path / 'meta').mkdir()
+            (col_path / 'meta' / 'execution-environment.yml').write_text(
+                'version: 1\ndependencies:\n  python: requirements.txt\n'
+            )
+        (col_path / 'requirements.txt').write_text(f'pkg{i}>=1\n')
+    return str(root)
+
+
+def test_introspect_collection_tree(tmp_path, mocker, best_time):
+    small = make_collection_tree(tmp_path / 'small', 200)
+    large = make_collection_tree(tmp_path / 'large', 2_000)
+
+    small_time = best_time(process, small)
+    large_time = best_time(process, large)
+
+    assert large_time / small_time < MAX_SCALING_RATIO, (
+        f'200 collections took {small_time:.3f}s, 2000 collections took {large_time:.3f}s'
+    )
+
+    # The metadata of every collection is parsed exactly once
+    cd_spy = mocker.spy(introspect.CollectionDefinition, '__init__')
+    data = process(large)
+    assert len(data['python']) == 2_000
+    assert cd_spy.call_count == 2_000
@@ -0,0 +1,63 @@
+import pytest
+import yaml
+
+from ansible_builder._target_scripts.introspect import process
+from ansible_builder.user_definition import UserDefinition
+
+
+pytestmark = [
+    pytest.mark.benchmark,
+    pytest.mark.skipif(not yaml.__with_libyaml__, reason='PyYAML was built without libyaml'),
+]
+
+
+def make_large_definition(path, num_lines=20_000):
+    data = {
+        'version': 3,
+        'images': {'base_image': {'name': 'quay.io/ansible/awx-ee:latest'}},
+        'dependencies': {
+            'python': [f'pkg{i}>={i % 7}' for i in range(num_lines)],
+            'system': [f'pkg{i} [platform:rpm]' for i in range(num_lines)],
+            'galaxy': {'collections': [{'name': f'ns.col{i}', 'version': '>=1.0.0'} for i in range(num_lines // 10)]},
+        },
+        'additional_build_steps': {
+            'append_final': [f'RUN echo {i}' for i in range(num_lines // 10)],
+        },
+    }
+    path.write_text(yaml.safe_dump(data))
+    return str(path)
+
+
+def make_collections(root, num_collections=200):
+    for i in range(num_collections):
+        col_path = root / 'ansible_collections' / 'ns' / f'col{i}'
+        (col_path / 'meta').mkdir(parents=True)
+        (col_path / 'galaxy.yml').write_text('')
+        (col_path / 'meta' / 'execution-environment.yml').write_text(yaml.safe_dump({
+            'version': 1,
+            'dependencies': {'python': 'requirements.txt', 'system': 'bindep.txt'},
+        }))
+        (col_path / 'requirements.txt').write_text(f'pkg{i}>=1\n')
+        (col_path / 'bindep.txt').write_text(f'pkg{i} [platform:rpm]\n')
+    return str(root)
+
+
+def test_large_definition_load(tmp_path, mocker, best_time):
+    path = make_large_definition(tmp_path / 'execution-environment.yml')
+
+    fast_time = best_time(UserDefinition, path)
+    mocker.patch('ansible_builder.utils.YamlLoader', yaml.SafeLoader)
+    slow_time = best_time(UserDefinition, path)
+
+    assert fast_time < slow_time, f'libyaml load took {fast_time:.3f}s, pure Python load took {slow_time:.3f}s'
+
+
+def test_introspect_many_collections(tmp_path, mocker, best_time):
+    path = make_collections(tmp_path)
+
+    fast_time = best_time(process, path)
+    mocker.patch('ansible_builder._target_scripts.introspect.yaml_support',
+                 return_value=(yaml, yaml.SafeLoader, yaml.SafeDumper))
+    slow_time = best_time(process, path)
+
+    assert fast_time < slow_time, f'libyaml introspection took {fast_time:.3f}s, pure Python took {slow_time:.3f}s'
@@ -1,5 +1,7 @@
 import os
 import runpy
+import subprocess
+import sys
 import pytest
 
 
@@ -372,3 +374,42 @@ def test_invalid_verbosity(exec_env_definition_file, tmp_path, verbosity_opt):
     path = str(exec_env_definition_file(content=content))
     with pytest.raises(ValueError, match=f'maximum verbosity is {constants.max_verbosity}'):
         prepare(['create', '-f', path, '-c', str(tmp_path), verbosity_opt])
+
+
+def test_copy_jobs(good_exec_env_definition_path, tmp_path):
+    path = str(good_exec_env_definition_path)
+
+    assert prepare(['create', '-f', path, '-c', str(tmp_path)]).containerfile.copy_jobs == 1
+    assert prepare(['create', '-f', path, '-c', str(tmp_path), '--copy-jobs', '8']).containerfile.copy_jobs == 8
+    with pytest.raises(SystemExit):
+        prepare(['create', '-f', path, '-c', str(tmp_path), '--copy-jobs', '0'])
+
+
+def test_cache_mounts(good_exec_env_definition_path, tmp_path):
+    path = str(good_exec_env_definition_path)
+
+    assert not prepare(['create', '-f', path, '-c', str(tmp_path)]).containerfile.cache_mounts
+    assert prepare(['build', '-f', path, '-c', str(tmp_path), '--cache-mounts']).containerfile.cache_mounts
+
+
+# Modules that are only needed to run a command, and must not slow down the CLI startup
+HEAVY_MODULES = (
+    'ansible_builder.main', 'ansible_builder.containerfile', 'ansible_builder.user_definition', 'jsonschema',
+    'yaml', 'requirements', 'packaging',
+)
+
+
+@pytest.mark.parametrize('args, heavy_modules', (
+    (['--help'], HEAVY_MODULES + ('importlib.metadata',)),
+    (['introspect', '--help'], HEAVY_MODULES + ('importlib.metadata',)),
+    (['--version'], HEAVY_MODULES),
+))
+def test_cli_startup_imports(args, heavy_modules):
+    code = f'from ansible_builder.cli import parse_args; parse_args({args!r})'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, check=True)
+
+    lines = result.stderr.splitlines()
+    imported = {line.rsplit('|', 1)[-1].strip() for line in lines if line.startswith('import time:')}
+    assert 'ansible_builder.cli' in imported
+    assert not imported.intersection(heavy_modules)
@@ -1,5 +1,13 @@
+import hashlib
+import tempfile
+
+from pathlib import Path
+
+import pytest
+
 from ansible_builder import constants
 from ansible_builder.containerfile import Containerfile
+from ansible_builder.exceptions import DefinitionError
 from ansible_builder.user_definition import UserDefinition
 
 # pylint: disable=W0212
@@ -209,6 +217,244 @@ def test__handle_additional_build_files(build_dir_and_ee_yml):
     assert (config_dir / 'ansible.cfg').exists()
 
 
+def test_context_manifest(build_dir_and_ee_yml, mocker):
+    """
+    Test that the context manifest is kept outside of the folder copied into
+    the image, and that a second run does not hash unchanged files.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python:
+        - requests
+    additional_build_files:
+      - src: ansible.cfg
+        dest: configs
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    (tmpdir / 'ansible.cfg').write_text('[defaults]\n')
+
+    make_containerfile(tmpdir, ee_path, run_validate=True).prepare()
+    assert (tmpdir / constants.context_manifest_file).exists()
+    assert not list((tmpdir / '_build').rglob(constants.context_manifest_file))
+
+    sha_spy = mocker.spy(hashlib, 'sha256')
+    make_containerfile(tmpdir, ee_path, run_validate=True).prepare()
+    # The inline python requirements are compared directly, so nothing is hashed
+    assert sha_spy.call_count == 0
+
+
+def test_inline_dependencies(build_dir_and_ee_yml, mocker):
+    """
+    Test that inline dependencies are written directly into the build context.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python:
+        - requests
+      galaxy:
+        collections:
+          - ansible.posix
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    tempfile_spy = mocker.spy(tempfile, 'NamedTemporaryFile')
+
+    make_containerfile(tmpdir, ee_path, run_validate=True).prepare()
+
+    assert tempfile_spy.call_count == 0
+    assert (tmpdir / '_build' / 'requirements.txt').read_text() == 'requests'
+    assert (tmpdir / '_build' / 'requirements.yml').read_text() == 'collections:\n- ansible.posix\n'
+
+
+def test_prune_context(build_dir_and_ee_yml):
+    """
+    Test that files from a previous version of the definition are removed from
+    the build context, and are no longer used, with prune_context.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python:
+        - requests
+    additional_build_files:
+      - src: files
+        dest: configs
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    (tmpdir / 'files' / 'empty').mkdir(parents=True)
+    (tmpdir / 'files' / 'sub').mkdir()
+    (tmpdir / 'files' / 'sub' / 'a.cfg').write_text('a')
+    (tmpdir / 'files' / 'b.cfg').write_text('b')
+    make_containerfile(tmpdir, ee_path, run_validate=True).prepare()
+    build_dir = tmpdir / '_build'
+    assert (build_dir / 'requirements.txt').exists()
+
+    # The python requirements and a file are removed from the definition
+    ee_path.write_text(ee_data.replace("""    dependencies:
+      python:
+        - requests
+""", ''))
+    (tmpdir / 'files' / 'sub' / 'a.cfg').unlink()
+    (build_dir / 'configs' / 'stray').mkdir()
+    (build_dir / 'configs' / 'stray' / 'c.cfg').write_text('c')
+
+    c = make_containerfile(tmpdir, ee_path, run_validate=True)
+    c.prepare()
+    assert (build_dir / 'requirements.txt').exists()
+    assert (build_dir / 'configs' / 'sub' / 'a.cfg').exists()
+
+    make_containerfile(tmpdir, ee_path, run_validate=True, prune_context=True).prepare()
+    assert sorted(str(path.relative_to(build_dir)) for path in build_dir.rglob('*')
+                  if not path.match('scripts/*')) == [
+        'configs', 'configs/b.cfg', 'configs/empty', 'configs/sub', 'scripts',
+    ]
+
+
+def galaxy_stage(steps):
+    start = steps.index('FROM base as galaxy')
+    return steps[start:steps.index('FROM base as builder', start)]
+
+
+def test_galaxy_stage_copy_boundaries(build_dir_and_ee_yml):
+    """
+    Test that the galaxy install layers only depend on the galaxy requirements,
+    and not on other files in the build context.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python:
+        - requests
+      galaxy:
+        collections:
+          - name: community.general
+          - name: https://example.com/ns-coll-1.0.0.tar.gz
+    additional_build_files:
+      - src: ansible.cfg
+        dest: configs
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    (tmpdir / 'ansible.cfg').write_text('[defaults]\n')
+
+    c = make_containerfile(tmpdir, ee_path, run_validate=True, galaxy_keyring=str(tmpdir / 'ansible.cfg'))
+    c.prepare()
+    steps = galaxy_stage(c.steps)
+    install = next(i for i, step in enumerate(steps) if 'ansible-galaxy collection install' in step)
+    copies = [step for step in steps[:install] if step.startswith('COPY')]
+    assert copies == [
+        'COPY _build/requirements.yml /build/requirements.yml',
+        'COPY _build/keyring.gpg /build/keyring.gpg',
+    ]
+    assert not [step for step in steps[install:] if step.startswith('COPY')]
+
+    # The rest of the build context is still available to custom steps, after the install
+    ee_path.write_text(ee_data + """
+    additional_build_steps:
+      append_galaxy:
+        - RUN ls /build/configs
+    """)
+    c = make_containerfile(tmpdir, ee_path, run_validate=True)
+    c.prepare()
+    steps = galaxy_stage(c.steps)
+    assert steps.index('COPY _build /build') > steps.index('COPY _build/requirements.yml /build/requirements.yml')
+    assert steps.index('COPY _build /build') < steps.index('RUN ls /build/configs')
+
+
+def test_galaxy_stage_ansible_config(build_dir_and_ee_yml, monkeypatch):
+    """
+    Test that the ansible.cfg file is available to the galaxy install when
+    only the galaxy requirements are copied before it.
+    """
+    ee_data = """
+    version: 2
+    ansible_config: ansible.cfg
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      galaxy: requirements.yml
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    (tmpdir / 'requirements.yml').write_text('collections:\n  - name: community.general\n')
+    (tmpdir / 'ansible.cfg').write_text('[galaxy]\nserver_list = private\n')
+    # The ansible_config path is relative to the current directory
+    monkeypatch.chdir(tmpdir)
+
+    c = make_containerfile(tmpdir, ee_path, run_validate=True)
+    c.prepare()
+    steps = galaxy_stage(c.steps)
+    install = next(i for i, step in enumerate(steps) if 'ansible-galaxy collection install' in step)
+    copies = [step for step in steps[:install] if step.startswith('COPY')]
+    assert copies == [
+        'COPY _build/requirements.yml /build/requirements.yml',
+        'COPY _build/ansible.cfg /build/ansible.cfg',
+    ]
+
+
+@pytest.mark.parametrize('collection', [
+    '{name: /build/collections/my_collection, type: dir}',
+    '{name: "git+file:///build/repos/my_collection", type: git}',
+    '{name: "file:///build/ns-coll-1.0.0.tar.gz", type: url}',
+    '{name: community.general, signatures: ["file:///build/community.general.asc"]}',
+])
+def test_galaxy_stage_local_requirements(build_dir_and_ee_yml, collection):
+    """
+    Test that the whole build context is copied before the galaxy install when
+    the galaxy requirements refer to local content.
+    """
+    ee_data = f"""
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      galaxy:
+        collections:
+          - {collection}
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    c = make_containerfile(tmpdir, ee_path, run_validate=True)
+    c.prepare()
+    steps = galaxy_stage(c.steps)
+    copies = [step for step in steps if step.startswith('COPY')]
+    assert copies == ['COPY _build /build']
+
+
+def test_galaxy_stage_malformed_requirements(build_dir_and_ee_yml):
+    """
+    Test that a galaxy requirements file that is not valid YAML is left for
+    ansible-galaxy to report, with the whole build context copied.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      galaxy: requirements.yml
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    (tmpdir / 'requirements.yml').write_text('collections:\n  - name: [community.general\n')
+    c = make_containerfile(tmpdir, ee_path, run_validate=True)
+    c.prepare()
+    steps = galaxy_stage(c.steps)
+    copies = [step for step in steps if step.startswith('COPY')]
+    assert copies == ['COPY _build /build']
+
+
 def test_pep668_v1(build_dir_and_ee_yml):
     """
     Test PEP668 handling with v1 format.
@@ -278,6 +524,136 @@ def test_pep668_v3_skip_pip_install(build_dir_and_ee_yml):
     assert "RUN /output/scripts/pip_install $PYCMD" not in c.steps
 
 
+@pytest.mark.parametrize('from_cli', (False, True))
+def test_cache_mounts(build_dir_and_ee_yml, from_cli):
+    """
+    Test that the download steps use build cache mounts with the cache_mounts option.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python_interpreter:
+        package_system: python311
+      python:
+        - requests
+      galaxy:
+        collections:
+          - name: community.general
+    """
+    if not from_cli:
+        ee_data += """
+    options:
+      cache_mounts: True
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    c = make_containerfile(tmpdir, ee_path, run_validate=True, cache_mounts=from_cli)
+    c.prepare()
+
+    pip = f'--mount=type=cache,id=ansible-builder-pip,target={constants.pip_cache_mount}'
+    dnf = '--mount=type=cache,id=ansible-builder-dnf,target=/var/cache/dnf,sharing=locked'
+    galaxy = f'--mount=type=cache,id=ansible-builder-galaxy,target={constants.galaxy_cache_mount}'
+    assert f'RUN {dnf} --mount=type=cache,id=ansible-builder-yum,target=/var/cache/yum,sharing=locked ' \
+        '$PKGMGR install $PYPKG -y' in c.steps
+    assert f'RUN {pip} $PYCMD -m pip install --cache-dir={constants.pip_cache_mount} ' \
+        'bindep pyyaml requirements-parser' in c.steps
+    assert not [step for step in c.steps if '--no-cache-dir' in step or 'clean all' in step]
+
+    galaxy_install = next(step for step in c.steps if 'ansible-galaxy collection install' in step)
+    assert galaxy_install.startswith(f'RUN {galaxy} ANSIBLE_GALAXY_CACHE_DIR={constants.galaxy_cache_mount} ')
+
+    introspect = next(step for step in c.steps if 'introspect.py' in step)
+    assert introspect.startswith(
+        f'RUN --mount=type=cache,id=ansible-builder-introspect,target={constants.introspect_cache_mount} '
+    )
+    assert f' --cache-dir={constants.introspect_cache_mount}' in introspect
+
+    for script in ('assemble', 'install-from-bindep'):
+        step = next(step for step in c.steps if f'/output/scripts/{script}' in step)
+        assert step.startswith(f'RUN {pip} {dnf} ')
+        assert f'PIP_CACHE_MOUNT={constants.pip_cache_mount} PKGMGR_PRESERVE_CACHE=always ' in step
+
+
+def test_no_cache_mounts(build_dir_and_ee_yml):
+    """
+    Test that no cache mounts are used by default.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python:
+        - requests
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    c = make_containerfile(tmpdir, ee_path, run_validate=True)
+    c.prepare()
+    assert not [step for step in c.steps if '--mount' in step]
+    assert 'RUN /output/scripts/assemble' in c.steps
+
+
+def test_single_python_install(build_dir_and_ee_yml):
+    """
+    Test that the Python requirements are installed in the builder stage only,
+    and copied into the final image, with the single_python_install option.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python:
+        - requests
+    options:
+      single_python_install: True
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    c = make_containerfile(tmpdir, ee_path, run_validate=True)
+    c.prepare()
+
+    tools = constants.builder_tools_path
+    root = constants.python_install_root
+    assert f'RUN $PYCMD -m pip install --no-cache-dir --target {tools} bindep pyyaml requirements-parser' in c.steps
+    assert next(step for step in c.steps if 'introspect.py' in step).startswith(f'RUN PYTHONPATH={tools} $PYCMD ')
+    assert f'RUN BUILDER_TOOLS={tools} PYTHON_INSTALL_ROOT={root} /output/scripts/assemble' in c.steps
+
+    final = c.steps[c.steps.index('FROM base as final'):]
+    install = final.index(f'RUN PYTHON_INSTALL_ROOT={root} /output/scripts/install-from-bindep '
+                          '&& rm -rf /output/wheels')
+    assert final.index(f'COPY --from=builder {root}/ /') == install + 1
+
+
+def test_mount_builder_output(build_dir_and_ee_yml):
+    """
+    Test that the builder output is bind mounted in the final stage, instead of
+    being copied into a layer of the final image, with the mount_builder_output option.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python:
+        - requests
+    options:
+      mount_builder_output: True
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    c = make_containerfile(tmpdir, ee_path, run_validate=True)
+    c.prepare()
+
+    final = c.steps[c.steps.index('FROM base as final'):]
+    assert 'RUN --mount=type=bind,from=builder,source=/output,target=/output,rw ' \
+        '/output/scripts/install-from-bindep' in final
+    assert not [step for step in final if step.startswith('COPY --from=builder')]
+
+
 def test_v1_builder_image(build_dir_and_ee_yml):
     """
     Test for issue 646 (https://github.com/ansible/ansible-builder/issues/646).
@@ -329,3 +705,114 @@ def test_v2_builder_image_default(build_dir_and_ee_yml):
     c.prepare()
     assert "FROM base as builder" in c.steps
     assert "COPY _build/scripts/pip_install /output/scripts/pip_install" not in c.steps
+
+
+def test_host_introspect(build_dir_and_ee_yml, mocker, monkeypatch, tmp_path):
+    """
+    Test that host introspection writes the combined requirements into the
+    build context and that the builder stage no longer depends on the galaxy stage.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      galaxy:
+        collections:
+          - ns.col
+      python:
+        - requests
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+    def fake_galaxy_install(command, **kwargs):
+        col_dir = Path(command[command.index('--collections-path') + 1]) / 'ansible_collections' / 'ns' / 'col'
+        col_dir.mkdir(parents=True)
+        (col_dir / 'MANIFEST.json').write_text('{"file_manifest_file": {"chksum_sha256": "abc123"}}')
+        (col_dir / 'requirements.txt').write_text('pytz\n-c constraints.txt\n')
+        (col_dir / 'constraints.txt').write_text('pytz<2030\n')
+        (col_dir / 'bindep.txt').write_text('subversion [platform:rpm]\n')
+        assert kwargs['env'] == {'ANSIBLE_GALAXY_DISABLE_GPG_VERIFY': '1'}
+        return (0, [])
+
+    run_mock = mocker.patch('ansible_builder.containerfile.run_command', side_effect=fake_galaxy_install)
+
+    c = make_containerfile(tmpdir, ee_path, run_validate=True, host_introspect=True)
+    c.prepare()
+
+    assert run_mock.call_args[0][0][:3] == ['ansible-galaxy', 'collection', 'install']
+    introspected = tmpdir / '_build' / 'introspected'
+    assert (introspected / 'requirements.txt').read_text() == (
+        'pytz  # from collection ns.col\nrequests  # from collection user\n'
+    )
+    assert (introspected / 'bindep.txt').read_text() == 'subversion [platform:rpm]  # from collection ns.col\n'
+    assert (introspected / 'upper-constraints.txt').read_text() == 'pytz<2030  # from collection ns.col\n'
+
+    builder_stage = c.steps[c.steps.index('FROM base as builder'):c.steps.index('FROM base as final')]
+    assert not [step for step in builder_stage if '--from=galaxy' in step]
+    assert not [step for step in builder_stage if 'introspect.py' in step]
+    assert 'COPY _build/introspected/requirements.txt /tmp/src/requirements.txt' in builder_stage
+    assert 'COPY _build/introspected/bindep.txt /tmp/src/bindep.txt' in builder_stage
+    assert 'COPY _build/introspected/upper-constraints.txt /tmp/src/upper-constraints.txt' in builder_stage
+    assert 'COPY --from=galaxy /usr/share/ansible /usr/share/ansible' in c.steps
+
+    # The introspection results of unchanged collections are cached on the host
+    assert list((tmp_path / 'cache' / 'ansible-builder' / 'introspect').glob('*.json'))
+
+
+def test_host_introspect_galaxy_options(build_dir_and_ee_yml, mocker, monkeypatch, tmp_path):
+    """
+    Test that the host install upgrades the collections of a previous run, and
+    uses the collection options given as build arguments.
+    """
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    build_arg_defaults:
+      ANSIBLE_GALAXY_CLI_COLLECTION_OPTS: '--pre'
+    dependencies:
+      galaxy:
+        collections:
+          - ns.col
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    run_mock = mocker.patch('ansible_builder.containerfile.run_command', return_value=(0, []))
+
+    make_containerfile(tmpdir, ee_path, run_validate=True, host_introspect=True).prepare()
+    command = run_mock.call_args[0][0]
+    assert '--upgrade' in command
+    assert '--pre' in command
+
+    make_containerfile(tmpdir, ee_path, run_validate=True, host_introspect=True,
+                       build_args={'ANSIBLE_GALAXY_CLI_COLLECTION_OPTS': '--force-with-deps'}).prepare()
+    command = run_mock.call_args[0][0]
+    assert '--force-with-deps' in command
+    assert '--pre' not in command
+
+    monkeypatch.setenv('ANSIBLE_GALAXY_CLI_COLLECTION_OPTS', '--timeout 120')
+    make_containerfile(tmpdir, ee_path, run_validate=True, host_introspect=True,
+                       build_args={'ANSIBLE_GALAXY_CLI_COLLECTION_OPTS': None}).prepare()
+    assert run_mock.call_args[0][0][-2:] == ['--timeout', '120']
+
+
+def test_host_introspect_conflict(build_dir_and_ee_yml):
+    ee_data = """
+    version: 3
+    images:
+      base_image:
+        name: quay.io/user/mycustombaseimage:latest
+    dependencies:
+      python:
+        - foo>=3
+        - foo<2
+    """
+    tmpdir, ee_path = build_dir_and_ee_yml(ee_data)
+    c = make_containerfile(tmpdir, ee_path, run_validate=True, host_introspect=True)
+
+    with pytest.raises(DefinitionError, match="foo: '>=3' from collection user conflicts with '<2'"):
+        c.prepare()
@@ -1,9 +1,16 @@
+import io
+import json
+import logging
 import os
+import tarfile
 import pytest
 
-from ansible_builder._target_scripts.introspect import process, process_collection
+from ansible_builder._target_scripts import introspect
+from ansible_builder._target_scripts.introspect import IntrospectionCache, process, process_collection
+from ansible_builder._target_scripts.introspect import CollectionArchive, process_collection_archive
 from ansible_builder._target_scripts.introspect import simple_combine, sanitize_requirements
-from ansible_builder._target_scripts.introspect import parse_args
+from ansible_builder._target_scripts.introspect import parse_args, run_introspect
+from ansible_builder._target_scripts.introspect import pip_file_data, resolve_pip_file
 
 
 def test_multiple_collection_metadata(data_dir):
@@ -28,6 +35,16 @@ def test_multiple_collection_metadata(data_dir):
     ]}
 
 
+def test_multiple_collection_metadata_jobs(data_dir):
+    """Reading collections concurrently must not change the result or its ordering"""
+    serial = process(data_dir)
+    parallel = process(data_dir, jobs=4)
+
+    assert parallel == serial
+    assert list(parallel['python']) == list(serial['python'])
+    assert list(parallel['system']) == list(serial['system'])
+
+
 def test_single_collection_metadata(data_dir):
 
     col_path = os.path.join(data_dir, 'ansible_collections', 'test', 'metadata')
@@ -37,6 +54,271 @@ def test_single_collection_metadata(data_dir):
     assert not sys_reqs
 
 
+def make_collection(root, namespace, name, requirements, files_checksum='abc123'):
+    col_path = root / 'ansible_collections' / namespace / name
+    col_path.mkdir(parents=True)
+    (col_path / 'requirements.txt').write_text('\n'.join(requirements))
+    (col_path / 'MANIFEST.json').write_text(json.dumps({
+        'collection_info': {'namespace': namespace, 'name': name, 'version': '1.0.0'},
+        'file_manifest_file': {'name': 'FILES.json', 'chksum_sha256': files_checksum},
+    }))
+    return col_path
+
+
+def test_introspection_cache(tmp_path, mocker):
+    make_collection(tmp_path, 'ns', 'one', ['foo>=1'])
+    col_path = make_collection(tmp_path, 'ns', 'two', ['bar'])
+    cache = IntrospectionCache(str(tmp_path / 'cache'))
+    expected = process(str(tmp_path))
+
+    assert process(str(tmp_path), cache=cache) == expected
+    assert len(list((tmp_path / 'cache').glob('*.json'))) == 2
+
+    # A warm cache must not parse any collection metadata
+    cd_mock = mocker.patch('ansible_builder._target_scripts.introspect.CollectionDefinition.__init__',
+                           side_effect=AssertionError('collection was parsed'))
+    assert process_collection(str(col_path), cache=cache) == (['bar'], [])
+    cd_mock.assert_not_called()
+
+
+def test_introspection_cache_outside_includes(tmp_path):
+    """Test that collections including files from outside of them are not cached"""
+    (tmp_path / 'common.txt').write_text('# shared\n')
+    col_path = make_collection(tmp_path, 'ns', 'one', ['foo', '-r sub/../../../../common.txt'])
+    (col_path / 'sub').mkdir()
+    make_collection(tmp_path, 'ns', 'two', ['bar'])
+    cache = IntrospectionCache(str(tmp_path / 'cache'))
+
+    assert process(str(tmp_path), cache=cache)['python'] == {'ns.one': ['foo'], 'ns.two': ['bar']}
+    assert len(list((tmp_path / 'cache').glob('*.json'))) == 1
+
+    (tmp_path / 'common.txt').write_text('shared\n')
+    assert process(str(tmp_path), cache=cache)['python'] == {'ns.one': ['foo', 'shared'], 'ns.two': ['bar']}
+
+
+def test_introspection_cache_key(tmp_path):
+    col_path = make_collection(tmp_path, 'ns', 'col', ['foo'])
+    manifest = col_path / 'MANIFEST.json'
+    cache = IntrospectionCache(str(tmp_path / 'cache'))
+
+    key = cache.key(str(col_path))
+    assert key
+
+    manifest.write_text(manifest.read_text().replace('abc123', 'def456'))
+    assert cache.key(str(col_path)) != key
+
+    # no FILES.json checksum, no caching
+    manifest.write_text('{}')
+    assert cache.key(str(col_path)) is None
+    manifest.unlink()
+    assert cache.key(str(col_path)) is None
+
+
+def test_introspection_cache_lru_eviction(tmp_path):
+    cache = IntrospectionCache(str(tmp_path), max_entries=2)
+    for i, key in enumerate(('a', 'b', 'c')):
+        cache.put(key, ([f'pkg{i}'], []))
+        os.utime(tmp_path / f'{key}.json', ns=(i * 10**9, i * 10**9))
+
+    # a hit refreshes the entry, so 'b' becomes the least recently used
+    assert cache.get('a') == (['pkg0'], [])
+    cache.prune()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.json', 'c.json']
+    assert cache.get('b') is None
+
+
+def make_collection_archive(path, namespace, name, files, files_checksum='abc123', prefix=''):
+    """Write a collection artifact with the given {name: content} files at the archive root.
+    The manifest is omitted if namespace is None.
+    """
+    if namespace is not None:
+        manifest = {
+            'collection_info': {'namespace': namespace, 'name': name, 'version': '1.0.0'},
+            'file_manifest_file': {'name': 'FILES.json', 'chksum_sha256': files_checksum},
+        }
+        files = {'MANIFEST.json': json.dumps(manifest), **files}
+    with tarfile.open(path, 'w:gz') as tar:
+        for filename, content in files.items():
+            data = content if isinstance(content, bytes) else content.encode()
+            info = tarfile.TarInfo(prefix + filename)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def test_collection_archive(tmp_path):
+    archive = make_collection_archive(tmp_path / 'ns-col-1.0.0.tar.gz', 'ns', 'col', {
+        'meta/execution-environment.yml': 'dependencies:\n  python: reqs/python.txt\n  system: bindep.cfg\n',
+        'reqs/python.txt': 'foo>=1\n-r base.txt\n',
+        'reqs/base.txt': 'bar\n',
+        'bindep.cfg': 'subversion [platform:rpm]\n',
+        'plugins/modules/big.py': 'x' * 4096,
+    })
+
+    assert process_collection_archive(str(archive)) == (
+        'ns.col', ['foo>=1', 'bar'], ['subversion [platform:rpm]']
+    )
+
+
+def test_collection_archive_inferred_requirements(tmp_path):
+    archive = make_collection_archive(tmp_path / 'collection.tar.gz', 'ns', 'col', {
+        'requirements.txt': 'foo\n',
+        'bindep.txt': '  \n',
+    })
+
+    assert process_collection_archive(str(archive)) == ('ns.col', ['foo'], [])
+
+
+def test_collection_archive_undecodable_file(tmp_path):
+    """Test that files which are not requirements files are never decoded"""
+    archive = make_collection_archive(tmp_path / 'ns-col-1.0.0.tar.gz', 'ns', 'col', {
+        'requirements.txt': 'foo\n',
+        'docs/notes.txt': 'caf\xe9\n'.encode('latin-1'),
+    })
+
+    assert process_collection_archive(str(archive)) == ('ns.col', ['foo'], [])
+
+
+def test_collection_archive_dot_prefixed_members(tmp_path):
+    """Test reading files that are not prefetched from archives created with 'tar -czf x.tar.gz ./'"""
+    archive = make_collection_archive(tmp_path / 'ns-col-1.0.0.tar.gz', 'ns', 'col', {
+        'meta/execution-environment.yml': 'dependencies:\n  python: reqs.pip\n',
+        'reqs.pip': 'foo\n',
+    }, prefix='./')
+
+    assert process_collection_archive(str(archive)) == ('ns.col', ['foo'], [])
+
+
+def test_collection_archive_unknown_name(tmp_path, caplog):
+    """Test that artifacts without a manifest or a namespace in their file name are ignored"""
+    archive = make_collection_archive(tmp_path / 'collection.tar.gz', None, None, {'requirements.txt': 'foo\n'})
+
+    assert process_collection_archive(str(archive)) is None
+    assert process(str(tmp_path)) == {'python': {}, 'system': {}}
+    assert 'collection.tar.gz' in caplog.text
+
+
+def test_collection_archive_without_manifest(tmp_path):
+    """Test that artifacts without a manifest are named after their file, if they have a galaxy.yml file"""
+    archive = make_collection_archive(tmp_path / 'ns-col-1.0.0.tar.gz', None, None, {
+        'galaxy.yml': 'namespace: ns\nname: col\n',
+        'requirements.txt': 'foo\n',
+    })
+
+    assert process_collection_archive(str(archive)) == ('ns.col', ['foo'], [])
+
+
+def test_collection_archive_not_a_collection(tmp_path, caplog):
+    """Test that other tarballs, and files that are not tar archives, are ignored"""
+    make_collection_archive(tmp_path / 'project-src-1.tar.gz', None, None, {'requirements.txt': 'foo\n'})
+    (tmp_path / 'broken-col-1.0.0.tar.gz').write_bytes(b'not a tar archive')
+    make_collection_archive(tmp_path / 'ns-col-1.0.0.tar.gz', 'ns', 'col', {'requirements.txt': 'bar\n'})
+
+    assert process_collection_archive(str(tmp_path / 'project-src-1.tar.gz')) is None
+    assert process_collection_archive(str(tmp_path / 'broken-col-1.0.0.tar.gz')) is None
+    assert process(str(tmp_path)) == {'python': {'ns.col': ['bar']}, 'system': {}}
+    assert 'project-src-1.tar.gz' in caplog.text
+    assert 'broken-col-1.0.0.tar.gz' in caplog.text
+
+
+def test_collection_archive_manifest_read_is_lazy(tmp_path, mocker):
+    archive = CollectionArchive(str(make_collection_archive(tmp_path / 'ns-col-1.0.0.tar.gz', 'ns', 'col', {})))
+    scan = mocker.spy(archive, '_scan')
+
+    assert json.loads(archive.read_manifest())['collection_info']['name'] == 'col'
+    assert archive.namespace_name() == ('ns', 'col')
+    scan.assert_not_called()
+
+
+def test_process_collection_archives(tmp_path):
+    make_collection_archive(tmp_path / 'b-col-1.0.0.tar.gz', 'b', 'col', {'requirements.txt': 'bar\n'})
+    make_collection_archive(tmp_path / 'a-col-1.0.0.tar.gz', 'a', 'col', {'requirements.txt': 'foo\n'})
+    make_collection_archive(tmp_path / 'a-col-2.0.0.tar.gz', 'a', 'col', {'requirements.txt': 'foo>=2\n'})
+    make_collection(tmp_path, 'c', 'col', ['baz'])
+
+    expected = {
+        'python': {'c.col': ['baz'], 'a.col': ['foo'], 'b.col': ['bar']},
+        'system': {},
+    }
+    for jobs in (1, 4):
+        data = process(str(tmp_path), jobs=jobs)
+        assert data == expected
+        assert list(data['python']) == list(expected['python'])
+
+    assert process(str(tmp_path / 'b-col-1.0.0.tar.gz')) == {'python': {'b.col': ['bar']}, 'system': {}}
+
+
+def test_process_collection_archive_cache(tmp_path, mocker):
+    archive = make_collection_archive(tmp_path / 'ns-col-1.0.0.tar.gz', 'ns', 'col', {'requirements.txt': 'foo\n'})
+    cache = IntrospectionCache(str(tmp_path / 'cache'))
+    assert process_collection_archive(str(archive), cache=cache) == ('ns.col', ['foo'], [])
+
+    scan = mocker.patch.object(CollectionArchive, '_scan', side_effect=AssertionError('archive was scanned'))
+    assert process_collection_archive(str(archive), cache=cache) == ('ns.col', ['foo'], [])
+    scan.assert_not_called()
+
+
+def test_pip_file_includes(tmp_path):
+    (tmp_path / 'requirements.txt').write_text('foo\n-r common/base.txt\n--constraint=constraints.txt\n')
+    (tmp_path / 'common').mkdir()
+    (tmp_path / 'common' / 'base.txt').write_text('# shared\nbar>=1\n')
+    (tmp_path / 'constraints.txt').write_text('foo<2\n--requirement common/pins.txt\n')
+    (tmp_path / 'common' / 'pins.txt').write_text('bar<3\n')
+
+    requirements, constraints = resolve_pip_file(str(tmp_path / 'requirements.txt'))
+
+    assert requirements == [
+        ('foo', str(tmp_path / 'requirements.txt'), 1),
+        ('bar>=1', str(tmp_path / 'common' / 'base.txt'), 2),
+    ]
+    # everything included from a constraints file is a constraint
+    assert [entry.line for entry in constraints] == ['foo<2', 'bar<3']
+    assert pip_file_data(str(tmp_path / 'requirements.txt')) == ['foo', 'bar>=1']
+
+
+def test_pip_file_include_cycle(tmp_path):
+    (tmp_path / 'a.txt').write_text('foo\n-r b.txt\n')
+    (tmp_path / 'b.txt').write_text('-r ./a.txt\n')
+
+    with pytest.raises(RuntimeError, match='include each other in a cycle: .*a.txt -> .*b.txt -> .*a.txt'):
+        resolve_pip_file(str(tmp_path / 'a.txt'))
+
+
+def test_pip_file_include_repeated(tmp_path):
+    """Including the same file twice without a cycle is allowed"""
+    (tmp_path / 'requirements.txt').write_text('-r common.txt\n-r common.txt\n')
+    (tmp_path / 'common.txt').write_text('foo\n')
+
+    assert pip_file_data(str(tmp_path / 'requirements.txt')) == ['foo', 'foo']
+
+
+def test_shared_includes_parsed_once(tmp_path, mocker):
+    (tmp_path / 'common.txt').write_text('shared\n')
+    for i in range(5):
+        col_path = make_collection(tmp_path, 'ns', f'col{i}', [f'pkg{i}', '-r ../../../common.txt'])
+        assert (col_path / '../../../common.txt').resolve() == tmp_path / 'common.txt'
+    parse_spy = mocker.spy(introspect, 'parse_pip_content')
+
+    data = process(str(tmp_path), jobs=2)
+
+    assert data['python']['ns.col4'] == ['pkg4', 'shared']
+    # once for each collection requirements.txt, and once for the shared file
+    assert parse_spy.call_count == 6
+
+
+def test_process_constraints(tmp_path):
+    make_collection(tmp_path, 'ns', 'one', ['foo', '-c constraints.txt'])
+    (tmp_path / 'ansible_collections' / 'ns' / 'one' / 'constraints.txt').write_text('foo<2\n')
+    make_collection(tmp_path, 'ns', 'two', ['bar'])
+
+    assert process(str(tmp_path)) == {
+        'python': {'ns.one': ['foo'], 'ns.two': ['bar']},
+        'system': {},
+        'constraints': {'ns.one': ['foo<2']},
+    }
+
+
 def test_parse_args_empty(capsys):
     with pytest.raises(SystemExit):
         parse_args()
@@ -67,6 +349,77 @@ def test_parse_args_default_action():
     assert parser.user_bindep == user_bindep
     assert parser.write_pip == write_pip
     assert parser.write_bindep == write_bindep
+    assert parser.jobs == 1
+
+
+def test_parse_args_jobs():
+    parser = parse_args(['introspect', '--jobs', '8'])
+    assert parser.jobs == 8
+
+
+def test_parse_args_cache():
+    parser = parse_args(['introspect', '--cache-dir', '/tmp/cache', '--cache-max-entries', '10'])
+    assert parser.cache_dir == '/tmp/cache'
+    assert parser.cache_max_entries == 10
+
+
+def test_parse_args_output_format():
+    assert parse_args(['introspect']).output_format == 'yaml'
+    assert parse_args(['introspect', '--output-format', 'ndjson']).output_format == 'ndjson'
+
+
+def test_introspect_ndjson_output(tmp_path, capsys):
+    make_collection(tmp_path, 'ns', 'one', ['# comment', 'foo>=1', '', 'bar'])
+    make_collection(tmp_path, 'ns', 'two', [])
+    user_pip = tmp_path / 'user-pip.txt'
+    user_pip.write_text('foo<3\n')
+
+    args = parse_args(['introspect', '--sanitize', '--output-format', 'ndjson', f'--user-pip={user_pip}',
+                       str(tmp_path)])
+    with pytest.raises(SystemExit) as exc:
+        run_introspect(args, logging.getLogger(__name__))
+    assert exc.value.code == 0
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert records == [
+        {'type': 'collection', 'collection': 'ns.one', 'system': [], 'python': [
+            {'requirement': 'foo>=1', 'file': 'requirements.txt', 'line': 2},
+            {'requirement': 'bar', 'file': 'requirements.txt', 'line': 4},
+        ]},
+        {'type': 'collection', 'collection': 'ns.two', 'python': [], 'system': []},
+        {'type': 'collection', 'collection': 'user', 'system': [], 'python': [
+            {'requirement': 'foo<3', 'file': str(user_pip), 'line': 1},
+        ]},
+        {'type': 'sanitized', 'system': [], 'python': [
+            'foo>=1,<3  # from collection ns.one,user',
+            'bar  # from collection ns.one',
+        ]},
+    ]
+
+
+def test_introspect_json_output(data_dir, capsys):
+    args = parse_args(['introspect', '--output-format', 'json', str(data_dir)])
+    with pytest.raises(SystemExit):
+        run_introspect(args, logging.getLogger(__name__))
+    assert json.loads(capsys.readouterr().out) == process(data_dir)
+
+
+def test_ndjson_provenance_is_cached(tmp_path):
+    make_collection(tmp_path, 'ns', 'one', ['', 'foo'])
+    cache = IntrospectionCache(str(tmp_path / 'cache'))
+    records = []
+    process(str(tmp_path), cache=cache, on_collection=lambda *record: records.append(record))
+    process(str(tmp_path), cache=cache, on_collection=lambda *record: records.append(record))
+
+    assert records[0] == records[1] == ('ns.one', [('foo', 'requirements.txt', 2)], [], [])
+
+
+@pytest.mark.parametrize('value', ['0', '-2', 'many'])
+def test_parse_args_jobs_invalid(value, capsys):
+    with pytest.raises(SystemExit):
+        parse_args(['introspect', '--jobs', value])
+    dummy, err = capsys.readouterr()
+    assert 'argument -j/--jobs' in err
 
 
 def test_yaml_extension(data_dir):
@@ -41,7 +41,7 @@ def test_galaxy_requirements(exec_env_definition_file, galaxy_requirements_file,
     with open(aee.containerfile.path) as f:
         content = f.read()
 
-    assert f'COPY {constants.user_content_subfolder} /build' in content
+    assert f'COPY {constants.user_content_subfolder}/requirements.yml /build/requirements.yml' in content
 
 
 def test_base_image_via_build_args(exec_env_definition_file, tmp_path):
@@ -150,3 +150,123 @@ def test_use_dockerfile(exec_env_definition_file, tmp_path, runtime):
         content = f.read()
 
     assert 'FROM' in content
+
+
+def test_create_skipped_when_inputs_unchanged(exec_env_definition_file, tmp_path, mocker):
+    content = {
+        'version': 3,
+        'dependencies': {'python': ['pytz']},
+        'additional_build_files': [{'src': 'files', 'dest': 'files'}],
+    }
+    path = exec_env_definition_file(content=content)
+    (path.parent / 'files').mkdir()
+    extra_file = path.parent / 'files' / 'extra.txt'
+    extra_file.write_text('one')
+
+    def create(**kwargs):
+        aee = AnsibleBuilder(action='create', filename=str(path), build_context=str(tmp_path / 'bc'), **kwargs)
+        prepare = mocker.spy(aee.containerfile, 'prepare')
+        aee.create()
+        return prepare.call_count
+
+    assert create() == 1
+    assert (tmp_path / 'bc' / constants.context_fingerprint_file).exists()
+    assert create() == 0
+    assert create(no_cache=True) == 1
+
+    # changes to referenced files, options and the build context are all detected
+    extra_file.write_text('two')
+    assert create() == 1
+    assert create() == 0
+    assert create(prune_context=True) == 1
+    (tmp_path / 'bc' / constants.user_content_subfolder / 'files' / 'extra.txt').unlink()
+    assert create(prune_context=True) == 1
+    assert create(prune_context=True) == 0
+
+
+def test_create_detects_changes_in_symlinked_directory(exec_env_definition_file, tmp_path, mocker):
+    """
+    Test that files in a symlinked directory of additional_build_files, which
+    are copied into the build context, are part of the context fingerprint.
+    """
+    content = {
+        'version': 3,
+        'additional_build_files': [{'src': 'files', 'dest': 'files'}],
+    }
+    path = exec_env_definition_file(content=content)
+    (path.parent / 'files').mkdir()
+    (path.parent / 'shared').mkdir()
+    shared_file = path.parent / 'shared' / 'shared.txt'
+    shared_file.write_text('one')
+    (path.parent / 'files' / 'linked').symlink_to(path.parent / 'shared', target_is_directory=True)
+
+    def create():
+        aee = AnsibleBuilder(action='create', filename=str(path), build_context=str(tmp_path / 'bc'))
+        prepare = mocker.spy(aee.containerfile, 'prepare')
+        aee.create()
+        return prepare.call_count
+
+    assert create() == 1
+    assert create() == 0
+    shared_file.write_text('three')
+    assert create() == 1
+    copied = tmp_path / 'bc' / constants.user_content_subfolder / 'files' / 'linked' / 'shared.txt'
+    assert copied.read_text() == 'three'
+
+
+def test_build_reuses_image_with_same_inputs(exec_env_definition_file, tmp_path, mocker):
+    path = exec_env_definition_file(content={'version': 3, 'dependencies': {'python': ['pytz']}})
+    images = {}
+
+    def fake_run_command(command, **kwargs):  # pylint: disable=W0613
+        if command[1] == 'build':
+            label = next(arg for arg in command if arg.startswith('--label='))
+            images[label.split('=', 2)[2]] = 'abc123'
+        elif command[1] == 'images':
+            digest = command[-1].split('=', 2)[2]
+            return (0, [images[digest]] if digest in images else [])
+        return (0, [])
+
+    run_mock = mocker.patch('ansible_builder.main.run_command', side_effect=fake_run_command)
+
+    def build(**kwargs):
+        run_mock.reset_mock()
+        aee = AnsibleBuilder(action='build', filename=str(path), build_context=str(tmp_path / 'bc'), tag=['ee:1'],
+                             **kwargs)
+        aee.build()
+        return [call.args[0][1] for call in run_mock.call_args_list]
+
+    runtime = AnsibleBuilder(action='build', filename=str(path)).container_runtime
+
+    assert build() == ['images', 'build']
+    assert build() == ['images', 'tag']
+    assert run_mock.call_args.args[0] == [runtime, 'tag', 'abc123', 'ee:1']
+    assert build(no_cache=True) == ['build']
+    assert build(build_args={'EE_BASE_IMAGE': 'other'}) == ['images', 'build']
+
+
+def test_input_digest_resolves_build_args_from_environment(exec_env_definition_file, tmp_path, monkeypatch):
+    path = exec_env_definition_file(content={'version': 3})
+
+    def input_digest():
+        aee = AnsibleBuilder(action='build', filename=str(path), build_context=str(tmp_path / 'bc'),
+                             build_args={'EE_BASE_IMAGE': None})
+        return aee.image_input_digest()
+
+    monkeypatch.setenv('EE_BASE_IMAGE', 'base:1')
+    first = input_digest()
+    assert input_digest() == first
+    monkeypatch.setenv('EE_BASE_IMAGE', 'base:2')
+    assert input_digest() != first
+
+
+def test_build_warns_about_unsupported_mounts(exec_env_definition_file, tmp_path, mocker, caplog):
+    path = exec_env_definition_file(content={'version': 3, 'options': {'cache_mounts': True}})
+    capabilities = mocker.patch('ansible_builder.main.get_runtime_capabilities',
+                                return_value={'version': '20.10.0', 'mounts': False})
+
+    aee = AnsibleBuilder(action='build', filename=str(path), build_context=str(tmp_path / 'bc'),
+                         container_runtime='docker')
+    aee.build()
+    capabilities.assert_called_once_with('docker')
+    assert 'docker 20.10.0 does not support the RUN --mount instructions' in caplog.text
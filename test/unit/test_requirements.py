@@ -1,4 +1,6 @@
-from ansible_builder._target_scripts.introspect import sanitize_requirements
+import pytest
+
+from ansible_builder._target_scripts.introspect import RequirementsConflictError, sanitize_requirements
 
 
 def test_combine_entries():
@@ -56,3 +58,56 @@ def test_sanitize_requirements_do_not_exclude():
         'pytest  # from collection user',
         'zoo  # from collection user',
     ]
+
+
+@pytest.mark.parametrize('reqs, expected', [
+    (
+        {'foo.bar': ['foo>=3'], 'bar.foo': ['foo<2']},
+        "foo: '>=3' from collection foo.bar conflicts with '<2' from collection bar.foo",
+    ),
+    (
+        {'foo.bar': ['foo==1.5'], 'bar.foo': ['foo>=1.0,<2'], 'user': ['foo!=1.5']},
+        "foo: '==1.5' from collection foo.bar conflicts with '!=1.5' from collection user",
+    ),
+    (
+        {'foo.bar': ['foo~=1.4.2'], 'bar.foo': ['foo>=1.5']},
+        "foo: '>=1.5' from collection bar.foo conflicts with '~=1.4.2' from collection foo.bar",
+    ),
+    (
+        {'foo.bar': ['foo==1.*'], 'bar.foo': ['foo>1.0'], 'baz.foo': ['foo>=2']},
+        "foo: '>=2' from collection baz.foo conflicts with '==1.*' from collection foo.bar",
+    ),
+    (
+        {'foo.bar': ['foo>2.0'], 'bar.foo': ['foo<=2.0']},
+        "foo: '>2.0' from collection foo.bar conflicts with '<=2.0' from collection bar.foo",
+    ),
+])
+def test_conflicting_specifiers(reqs, expected):
+    with pytest.raises(RequirementsConflictError) as exc:
+        sanitize_requirements(reqs)
+    assert expected in str(exc.value)
+
+
+@pytest.mark.parametrize('reqs', [
+    {'foo.bar': ['foo>=1.0,<2'], 'bar.foo': ['foo>=1.5'], 'user': ['foo!=1.6']},
+    {'foo.bar': ['foo==2.0'], 'bar.foo': ['foo>=2.0,<=2.0']},
+    {'foo.bar': ['foo==1.0'], 'bar.foo': ['foo==1.0.0']},
+    {'foo.bar': ['foo~=1.4'], 'bar.foo': ['foo<=1.9']},
+    {'foo.bar': ['foo===weird'], 'bar.foo': ['foo<1']},
+])
+def test_compatible_specifiers(reqs):
+    assert len(sanitize_requirements(reqs)) == 1
+
+
+def test_excluded_packages_are_not_checked_for_conflicts():
+    reqs = {
+        'a.b': ['ansible-core>=2.16', 'pytest>=8', 'foo'],
+        'c.d': ['ansible-core<2.15', 'pytest<7'],
+    }
+    assert sanitize_requirements(reqs) == ['foo  # from collection a.b']
+
+    # Packages from the user requirements are kept, so they are still checked
+    reqs['user'] = ['pytest']
+    with pytest.raises(RequirementsConflictError) as exc:
+        sanitize_requirements(reqs)
+    assert "pytest: '>=8' from collection a.b conflicts with '<7' from collection c.d" in str(exc.value)
@@ -1,7 +1,9 @@
 import os
+import pickle
+
 import pytest
 
-from ansible_builder import constants
+from ansible_builder import constants, ee_schema
 from ansible_builder.exceptions import DefinitionError
 from ansible_builder.main import AnsibleBuilder
 from ansible_builder.user_definition import UserDefinition, ImageDescription
@@ -213,6 +215,31 @@ class TestUserDefinition:
         system_req = definition.raw.get('dependencies', {}).get('system')
         assert system_req == ['req1', 'req2']
 
+    def test_v3_inline_dependency_resolved_once(self, exec_env_definition_file):
+        """
+        Test that inline dependencies are resolved, and written to a temporary file, once.
+        """
+        path = exec_env_definition_file(
+            "{'version': 3, 'images': { 'base_image': {'name': 'base_image:latest'}},"
+            "'dependencies': {'python': ['req1', 'req2'], 'system': 'bindep.txt'}}"
+        )
+        definition = UserDefinition(path)
+
+        dependency = definition.get_dependency('python')
+        assert dependency.content == 'req1\nreq2'
+        assert dependency.path is None
+        assert definition.get_dependency('python') is dependency
+        assert definition.get_dependency('system').path == os.path.join(os.path.dirname(path), 'bindep.txt')
+
+        abs_path = definition.get_dep_abs_path('python')
+        assert definition.get_dep_abs_path('python') == abs_path
+        with open(abs_path) as f:
+            assert f.read() == 'req1\nreq2'
+
+        # Changes to the definition are picked up
+        definition.raw['dependencies']['python'] = ['req3']
+        assert definition.get_dependency('python').content == 'req3'
+
     def test_v3_skip_ansible_check_default(self, exec_env_definition_file):
         """
         Test that options.skip_ansible_check defaults to False
@@ -267,6 +294,67 @@ class TestUserDefinition:
         value = definition.raw.get('options', {}).get('tags')
         assert value == ['ee_test:latest']
 
+    def test_v3_resolved(self, exec_env_definition_file):
+        """
+        Test that the resolved definition has the defaults applied and can be hashed and pickled
+        """
+        path = exec_env_definition_file(
+            "{'version': 3, 'images': { 'base_image': {'name': 'base_image:latest'}},"
+            "'dependencies': {'python': ['req1']},"
+            "'additional_build_steps': {'append_final': \"RUN one\\nRUN two\"},"
+            "'additional_build_files': [{'src': 'files', 'dest': 'configs'}],"
+            "'options': {'tags': ['ee_test:latest']}}"
+        )
+        definition = UserDefinition(path)
+        definition.validate()
+        resolved = definition.resolved
+
+        assert resolved is definition.resolved
+        assert resolved.base_image.name == 'base_image:latest'
+        assert resolved.get_build_arg('EE_BASE_IMAGE') == 'base_image:latest'
+        assert resolved.get_build_steps('append_final') == ('RUN one', 'RUN two')
+        assert resolved.get_build_steps('prepend_final') == ()
+        assert resolved.additional_build_files == (('files', 'configs'),)
+        assert resolved.get_dependency('python').content == 'req1'
+        assert resolved.get_dependency('galaxy') is None
+        assert resolved.tags == ('ee_test:latest',)
+        assert resolved.workdir == '/runner'
+        assert resolved.relax_passwd_permissions
+        assert not resolved.skip_pip_install
+
+        copy = pickle.loads(pickle.dumps(resolved))
+        assert copy == resolved
+        assert hash(copy) == hash(resolved)
+
+    def test_v2_resolved(self, exec_env_definition_file):
+        """
+        Test that the options of version 3 are disabled for older versions
+        """
+        path = exec_env_definition_file("{'version': 2, 'images': { 'base_image': {'name': 'base_image:latest'}}}")
+        definition = UserDefinition(path)
+        definition.validate()
+        resolved = definition.resolved
+
+        assert resolved.skip_pip_install
+        assert resolved.skip_ansible_check
+        assert not resolved.relax_passwd_permissions
+        assert resolved.workdir is None
+        assert resolved.package_manager_path is None
+        assert resolved.tags == ()
+
+    def test_validator_reused(self, exec_env_definition_file):
+        """
+        Test that the schema validator is created once and reused
+        """
+        path = exec_env_definition_file(
+            "{'version': 3, 'images': { 'base_image': {'name': 'base_image:latest'}}}"
+        )
+        ee_schema.get_validator.cache_clear()
+        UserDefinition(path).validate()
+        UserDefinition(path).validate()
+
+        assert ee_schema.get_validator.cache_info().misses == 1
+
 
 class TestImageDescription:
 
@@ -1,10 +1,17 @@
+import errno
 import filecmp
+import json
 import os
 import pathlib
+import time
 
 import pytest
+import yaml
 
+from ansible_builder import constants
 from ansible_builder.utils import configure_logger, write_file, copy_directory, copy_file, run_command
+from ansible_builder.utils import ContextManifest, yaml_safe_dump, yaml_safe_load
+from ansible_builder.utils import detect_container_runtime, get_runtime_capabilities
 
 
 def test_write_file(tmp_path):
@@ -64,6 +71,50 @@ def test_copy_file_with_destination_directory(dest_file, source_file):
     assert copy_file(source_file, dest_file)
 
 
+def test_copy_file_manifest(tmp_path, mocker):
+    source = tmp_path / 'source.txt'
+    dest = tmp_path / 'dest.txt'
+    manifest_path = str(tmp_path / 'manifest.json')
+    source.write_text('foo')
+
+    manifest = ContextManifest(manifest_path)
+    assert copy_file(str(source), str(dest), manifest=manifest)
+    assert not copy_file(str(source), str(dest), manifest=manifest)
+    manifest.save()
+
+    # Unchanged files are neither compared nor hashed again by a later run
+    cmp_mock = mocker.patch('filecmp.cmp', side_effect=AssertionError('files were compared'))
+    sha_mock = mocker.patch('hashlib.sha256', side_effect=AssertionError('files were hashed'))
+    manifest = ContextManifest(manifest_path)
+    assert not copy_file(str(source), str(dest), manifest=manifest)
+    cmp_mock.assert_not_called()
+    sha_mock.assert_not_called()
+    mocker.stopall()
+
+    # A modified destination is detected from its signature
+    dest.write_text('bar!')
+    assert copy_file(str(source), str(dest), manifest=manifest)
+    assert dest.read_text() == 'foo'
+
+    # So is a touched source, which is rewritten as without a manifest
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert copy_file(str(source), str(dest), manifest=manifest)
+    assert not copy_file(str(source), str(dest), manifest=manifest)
+
+
+def test_context_manifest_invalid(tmp_path):
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text('not json')
+    source = tmp_path / 'source.txt'
+    source.write_text('foo')
+
+    manifest = ContextManifest(str(manifest_path))
+    assert manifest.file_digest(str(source)) == '2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae'
+    manifest.save()
+    assert list(json.loads(manifest_path.read_text())['files']) == [str(source)]
+
+
 @pytest.mark.run_command
 def test_failed_command(mocker):
     mocker.patch('ansible_builder.utils.subprocess.Popen.wait', return_value=1)
@@ -145,3 +196,151 @@ def test_copy_directory(tmp_path):
     dcmp = filecmp.dircmp(str(src), str(dst))
     assert not dcmp.left_only
     assert not dcmp.right_only
+
+
+def test_copy_directory_jobs(tmp_path, caplog):
+    """Copying concurrently must create the same files and log the same messages"""
+    src = tmp_path / 'src'
+    for d in range(3):
+        (src / f'd{d}' / 'sub').mkdir(parents=True)
+        for f in range(10):
+            (src / f'd{d}' / f'f{f}').write_text(f'{d} {f}')
+            (src / f'd{d}' / 'sub' / f'f{f}').write_text(f'sub {d} {f}')
+
+    messages = {}
+    for jobs in (1, 4):
+        dst = tmp_path / f'dst{jobs}'
+        dst.mkdir()
+        caplog.clear()
+        with caplog.at_level('DEBUG', logger='ansible_builder.utils'):
+            copy_directory(src, dst, jobs=jobs)
+        messages[jobs] = [record.getMessage().replace(str(dst), 'DST') for record in caplog.records]
+
+        dcmp = filecmp.dircmp(str(src), str(dst))
+        assert not dcmp.left_only
+        assert not dcmp.right_only
+        assert (dst / 'd2' / 'sub' / 'f9').read_text() == 'sub 2 9'
+
+    assert messages[4] == messages[1]
+    assert messages[1][:2] == ['File DST/d0/f0 will be created.', 'File DST/d0/f1 will be created.']
+
+
+@pytest.mark.parametrize('mode', ['copy', 'reflink', 'hardlink', 'auto'])
+def test_copy_file_modes(source_file, tmp_path, mode):
+    dest = tmp_path / 'dest.txt'
+
+    assert copy_file(str(source_file), str(dest), mode=mode)
+    assert dest.read_text() == source_file.read_text()
+    assert dest.stat().st_mtime_ns == source_file.stat().st_mtime_ns
+    assert not copy_file(str(source_file), str(dest), mode=mode)
+
+
+def test_copy_file_reflink_fallback(source_file, tmp_path, mocker, caplog):
+    dest = tmp_path / 'dest.txt'
+    mocker.patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'Operation not supported'))
+
+    with caplog.at_level('DEBUG', logger='ansible_builder.utils'):
+        assert copy_file(str(source_file), str(dest), mode='auto')
+    assert dest.read_text() == source_file.read_text()
+    assert f'Unable to reflink {source_file} (Operation not supported), copying it instead.' in caplog.text
+
+
+def test_copy_file_hardlink(source_file, tmp_path):
+    dest = tmp_path / 'dest.txt'
+
+    assert copy_file(str(source_file), str(dest), mode='hardlink')
+    assert os.path.samefile(source_file, dest)
+
+    # Copying another file over the link must not modify the linked source file
+    other = tmp_path / 'other.txt'
+    other.write_text('other')
+    original = source_file.read_text()
+    assert copy_file(str(other), str(dest))
+    assert dest.read_text() == 'other'
+    assert source_file.read_text() == original
+
+
+def test_yaml_round_trip():
+    data = {'version': 3, 'dependencies': {'python': ['foo>=1', 'bar']}, 'name': 'caf\u00e9'}
+    assert yaml_safe_load(yaml_safe_dump(data)) == data
+    assert yaml_safe_dump(data) == yaml.safe_dump(data)
+
+
+def test_yaml_safe_load_rejects_python_tags():
+    with pytest.raises(yaml.constructor.ConstructorError):
+        yaml_safe_load('!!python/object/apply:os.system ["true"]')
+
+
+def test_yaml_safe_load_error_message(tmp_path):
+    """Syntax errors should be as descriptive as the pure Python loader ones"""
+    path = tmp_path / 'bad.yml'
+    path.write_text('foo: bar: baz\n')
+
+    with open(path) as f, pytest.raises(yaml.scanner.ScannerError) as exc:
+        yaml_safe_load(f)
+    with open(path) as f, pytest.raises(yaml.scanner.ScannerError) as expected:
+        yaml.safe_load(f)
+    assert str(exc.value) == str(expected.value)
+
+
+@pytest.fixture
+def clear_runtime_caches():
+    detect_container_runtime.cache_clear()
+    get_runtime_capabilities.cache_clear()
+    yield
+    detect_container_runtime.cache_clear()
+    get_runtime_capabilities.cache_clear()
+
+
+@pytest.mark.usefixtures('clear_runtime_caches')
+def test_detect_container_runtime(mocker):
+    which = mocker.patch('shutil.which', side_effect=lambda cmd: '/usr/bin/docker' if cmd == 'docker' else None)
+    assert detect_container_runtime() == 'docker'
+    assert detect_container_runtime() == 'docker'
+    assert which.call_count == 1
+
+    # The constant is looked up lazily, when it is used
+    assert constants.default_container_runtime == 'docker'
+    assert which.call_count == 2
+    with pytest.raises(AttributeError):
+        getattr(constants, 'no_such_constant')
+
+
+@pytest.mark.usefixtures('clear_runtime_caches')
+def test_get_runtime_capabilities(tmp_path, mocker, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    podman = tmp_path / 'podman'
+    podman.write_text('')
+    mocker.patch('shutil.which', return_value=str(podman))
+    run = mocker.patch('subprocess.run', return_value=mocker.Mock(stdout=json.dumps({'Client': {'Version': '4.9.3'}})))
+
+    expected = {'version': '4.9.3', 'mounts': True}
+    assert get_runtime_capabilities('podman') == expected
+    assert get_runtime_capabilities('podman') == expected
+    assert run.call_count == 1
+
+    # A new process uses the capabilities cached on disk
+    get_runtime_capabilities.cache_clear()
+    assert get_runtime_capabilities('podman') == expected
+    assert run.call_count == 1
+
+    # Until they expire
+    get_runtime_capabilities.cache_clear()
+    mocker.patch('time.time', return_value=time.time() + constants.runtime_capabilities_ttl + 1)
+    assert get_runtime_capabilities('podman') == expected
+    assert run.call_count == 2
+
+    # Or the runtime changes
+    get_runtime_capabilities.cache_clear()
+    run.return_value = mocker.Mock(stdout=json.dumps({'Client': {'Version': '3.4.4'}}))
+    podman.write_text('upgraded')
+    assert get_runtime_capabilities('podman') == {'version': '3.4.4', 'mounts': False}
+    assert run.call_count == 3
+
+
+@pytest.mark.usefixtures('clear_runtime_caches')
+def test_get_runtime_capabilities_unknown(mocker):
+    mocker.patch('shutil.which', return_value=None)
+    run = mocker.patch('subprocess.run')
+    assert get_runtime_capabilities('docker') == {}
+    assert run.call_count == 0